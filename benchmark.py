@@ -0,0 +1,283 @@
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import telebot
+
+# -------------------------
+# Synthetic-data benchmark for the account, club and leaderboard paths.
+# Generates accounts.json / club.db at several sizes, drives the real handlers
+# through a TeleBot that records sends instead of calling Telegram, and reports
+# latency percentiles, throughput and peak memory per handler.
+#
+#   python benchmark.py --sizes 1000,10000,100000,1000000 --iterations 200
+# -------------------------
+ADMIN_ID = 1000000001
+USER_CHAT_BASE = 2000000000
+CLUBS_PER_1K = 20
+
+
+class RecordingTeleBot(telebot.TeleBot):
+    # runs handlers inline and records outgoing calls instead of hitting the API
+    def __init__(self):
+        super().__init__("0:benchmark", threaded=False)
+        self.sent = []
+        self.next_message_id = 1
+
+    def _record(self, method, chat_id, payload):
+        self.next_message_id += 1
+        self.sent.append((method, chat_id, payload))
+        return SimpleNamespace(message_id=self.next_message_id, photo=[])
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        return self._record("sendMessage", chat_id, text)
+
+    def reply_to(self, message, text, **kwargs):
+        return self._record("sendMessage", message.chat.id, text)
+
+    def send_photo(self, chat_id, photo, *args, **kwargs):
+        return self._record("sendPhoto", chat_id, photo)
+
+    def send_media_group(self, chat_id, media, *args, **kwargs):
+        return [self._record("sendMediaGroup", chat_id, item) for item in media]
+
+    def export_chat_invite_link(self, chat_id):
+        return "https://t.me/+benchmark"
+
+
+def generate_database(directory, size, seed=1, accounts_mode="memory", storage="json"):
+    rng = random.Random(seed)
+    club_count = max(1, size * CLUBS_PER_1K // 1000)
+    os.makedirs(os.path.join(directory, "Database", "Player"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "Database", "Club"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "JSON"), exist_ok=True)
+    # written one account at a time so the generator does not dominate max RSS
+    with open(os.path.join(directory, "Database", "Player", "accounts.json"), "w", encoding="utf-8") as f:
+        f.write('{"Accounts":{')
+        for i in range(1, size + 1):
+            trophies = rng.randint(0, 20000)
+            account = {
+                "name": f"player{i}",
+                "lowID": i,
+                "token": f"{rng.getrandbits(64):016x}",
+                "trophies": trophies,
+                "highesttrophies": trophies + rng.randint(0, 2000),
+                "soloWins": rng.randint(0, 5000),
+                "duoWins": rng.randint(0, 5000),
+                "3vs3Wins": rng.randint(0, 10000),
+                "gems": rng.randint(0, 100000),
+                "gold": rng.randint(0, 100000),
+                "clubID": rng.randint(1, club_count) if rng.random() < 0.6 else 0,
+            }
+            f.write(("," if i > 1 else "") + json.dumps(str(i)) + ":" + json.dumps(account, separators=(",", ":")))
+        f.write("}}")
+    clubs = {}
+    for club_id in range(1, club_count + 1):
+        clubs[str(club_id)] = {"clubID": club_id, "info": {"name": f"Club {club_id}", "description": "benchmark club"},
+                               "members": {}}
+    with open(os.path.join(directory, "Database", "Club", "club.db"), "w", encoding="utf-8") as f:
+        json.dump({"Clubs": clubs}, f)
+    with open(os.path.join(directory, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({"ThemeID": 0, "Maintenance": False}, f)
+    with open(os.path.join(directory, "server_config.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "admin_ids": [str(ADMIN_ID)],
+            "support_group_id": "-100123",
+            "broadcast_rate": 1000000,
+            "stats_interval": 60,
+            "accounts_mode": accounts_mode,
+            "storage": storage,
+        }, f)
+    if storage == "sqlite":
+        import migrate_db
+        migrate_db.migrate(os.path.join(directory, "Database", "Player", "accounts.json"),
+                           os.path.join(directory, "Database", "Club", "club.db"),
+                           os.path.join(directory, "Database", "database.sqlite"))
+
+
+def make_update(update_id, chat_id, text):
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"bench{chat_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return telebot.types.Update.de_json({"update_id": update_id, "message": message})
+
+
+class Driver:
+    def __init__(self, bot, size, news_audience):
+        self.bot = bot
+        self.size = size
+        self.rng = random.Random(2)
+        self.update_id = 0
+        self.bot.all_users.update(USER_CHAT_BASE + i for i in range(news_audience))
+
+    def send(self, chat_id, text):
+        self.update_id += 1
+        self.bot.bot.process_new_updates([make_update(self.update_id, chat_id, text)])
+
+    def random_name(self):
+        return f"player{self.rng.randint(1, self.size)}"
+
+    # each scenario returns a callable that performs exactly one timed handler call
+    def scenarios(self):
+        profile_chat = USER_CHAT_BASE + 1
+        self.send(profile_chat, "/login")
+        self.send(profile_chat, self.random_name())
+
+        def login():
+            chat_id = USER_CHAT_BASE + 2
+            self.send(chat_id, "/login")
+            return lambda: self.send(chat_id, self.random_name())
+
+        def news():
+            # let the previous broadcast finish so it does not skew the next call
+            self.bot.broadcaster.join()
+            self.send(ADMIN_ID, "/add_news")
+            return lambda: self.send(ADMIN_ID, "Benchmark news")
+
+        return [
+            ("handle_login", login),
+            ("profile", lambda: lambda: self.send(profile_chat, "/profile")),
+            ("leaderboard", lambda: lambda: self.send(USER_CHAT_BASE + 3, "/leaderboard")),
+            ("leaderboard_page", lambda: lambda: self.send(USER_CHAT_BASE + 3, f"/leaderboard solo {self.rng.randint(1, 50)}")),
+            ("addgems", lambda: lambda: self.send(ADMIN_ID, f"/addgems {self.random_name()} {self.rng.randint(0, 99999)}")),
+            ("handle_news", news),
+        ]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def run_scenario(prepare, iterations, trace_memory):
+    latencies = []
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call = prepare()
+        t0 = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    latencies.sort()
+    return {
+        "n": iterations,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+        "max": latencies[-1] * 1000,
+        "mean": statistics.fmean(latencies) * 1000,
+        "ops": iterations / sum(latencies) if sum(latencies) else 0.0,
+        "wall": elapsed,
+        "peak_kb": peak / 1024,
+    }
+
+
+def benchmark_size(size, iterations, memory_iterations, news_audience, keep, accounts_mode="memory", storage="json"):
+    import tgbot
+
+    directory = tempfile.mkdtemp(prefix=f"zerux-bench-{size}-")
+    cwd = os.getcwd()
+    results = {}
+    try:
+        t0 = time.perf_counter()
+        generate_database(directory, size, accounts_mode=accounts_mode, storage=storage)
+        generate_time = time.perf_counter() - t0
+        db_bytes = os.path.getsize(os.path.join(directory, "Database", "Player", "accounts.json"))
+        os.chdir(directory)
+        bot = tgbot.TelegramBot("0:benchmark", bot=RecordingTeleBot())
+        # the recording bot has no per-chat limits to respect
+        bot.broadcaster.sender.PRIVATE_INTERVAL = bot.broadcaster.sender.GROUP_INTERVAL = 0
+        t0 = time.perf_counter()
+        bot.accounts.refresh()
+        results["cold_load"] = time.perf_counter() - t0
+        driver = Driver(bot, size, news_audience)
+        for name, prepare in driver.scenarios():
+            timing = run_scenario(prepare, iterations, trace_memory=False)
+            timing["peak_kb"] = run_scenario(prepare, memory_iterations, trace_memory=True)["peak_kb"]
+            results[name] = timing
+            bot.bot.sent.clear()
+        # full delivery of one broadcast, not just the handler hand-off
+        bot.broadcaster.join()
+        audience = list(bot.all_users)
+        t0 = time.perf_counter()
+        bot.broadcaster._run(audience, "Benchmark news", ADMIN_ID)
+        delivery = time.perf_counter() - t0
+        results["news_delivery"] = {"n": len(audience), "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": delivery * 1000,
+                                    "mean": delivery * 1000 / max(1, len(audience)), "ops": len(audience) / delivery,
+                                    "wall": delivery, "peak_kb": 0.0}
+        bot.shutdown()
+        results["generate"] = generate_time
+        results["db_mb"] = db_bytes / (1024 * 1024)
+        results["maxrss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    finally:
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def print_report(size, results, out):
+    out.write(f"\n=== {size:,} accounts ({results['db_mb']:.1f} MB accounts.json, generated in {results['generate']:.1f}s, "
+              f"cold load {results['cold_load'] * 1000:.0f} ms, process max RSS {results['maxrss_mb']:.0f} MB) ===\n")
+    out.write(f"{'handler':<18}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'ops/s':>11}{'peak KB':>11}\n")
+    for name, r in results.items():
+        if not isinstance(r, dict):
+            continue
+        out.write(f"{name:<18}{r['n']:>6}{r['p50']:>10.3f}{r['p95']:>10.3f}{r['p99']:>10.3f}{r['max']:>10.3f}"
+                  f"{r['ops']:>11.0f}{r['peak_kb']:>11.0f}\n")
+    out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark tgbot handlers against synthetic databases")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="comma separated account counts")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per handler")
+    parser.add_argument("--memory-iterations", type=int, default=20, help="calls per handler under tracemalloc")
+    parser.add_argument("--news-audience", type=int, default=1000, help="known chats for the news broadcast")
+    parser.add_argument("--json", help="also write raw results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the generated databases")
+    parser.add_argument("--accounts-mode", choices=["memory", "streaming"], default="memory",
+                        help="account store to benchmark (see accounts_mode in server_config.json)")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json",
+                        help="storage backend to benchmark; sqlite migrates the generated files first")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    all_results = {}
+    for size in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        results = benchmark_size(size, args.iterations, args.memory_iterations, args.news_audience, args.keep,
+                                 args.accounts_mode, args.storage)
+        all_results[size] = results
+        print_report(size, results, sys.stdout)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(all_results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
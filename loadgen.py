@@ -0,0 +1,436 @@
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import telebot
+
+# -------------------------
+# End-to-end load generator. Feeds a generated (or replayed) stream of Telegram
+# updates into TelegramBot.bot.process_new_updates at stepped rates, with every
+# Bot API call going to a local fake server that adds latency and the odd 429.
+# Per step it reports throughput, p50/p99 handler and end-to-end latency and
+# how fast the lane backlog grows, i.e. whether the bot keeps up at that rate.
+#
+#   python loadgen.py --rates 25,50,100,200 --duration 20
+#   python loadgen.py --record updates.jsonl --rates 50      # save the stream
+#   python loadgen.py --replay updates.jsonl --rates 50      # feed it again
+# -------------------------
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import benchmark
+import tgbot
+
+BOT_TOKEN = "0:loadgen"
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Zerux Bot", "username": "zerux_bot"}
+SUPPORT_GROUP_ID = -100123   # what benchmark.generate_database writes as support_group_id
+DEFAULT_MIX = "login=25,profile=30,leaderboard=20,support=15,reply=10"
+
+
+class FakeBotAPI:
+    # Bot API stand-in: answers every method after a lognormal delay around
+    # `latency`, and a `rate_limited` share of sends with 429 + retry_after.
+    SEND_METHODS = {"sendMessage", "sendPhoto", "sendMediaGroup", "forwardMessage", "copyMessage"}
+
+    def __init__(self, latency=0.05, rate_limited=0.01, retry_after=1, seed=3):
+        self.latency = latency
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.next_message_id = 0
+        self.last_ticket = {}       # group chat id -> (message id, is digest) of the last support ticket posted there
+        self.calls = {}             # method -> count
+        self.limited = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-bot-api", daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/bot{{0}}/{{1}}"
+
+    def start(self):
+        self.thread.start()
+        telebot.apihelper.API_URL = self.url
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive, like the real API
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                    params.update({key: values[-1] for key, values in parse_qs(body.decode("utf-8", "replace")).items()})
+                status, payload = api.answer(url.path.rsplit("/", 1)[-1], params)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def answer(self, method, params):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            delay = self.latency * self.rng.lognormvariate(0, 0.5)
+            limited = method in self.SEND_METHODS and self.rng.random() < self.rate_limited
+            if limited:
+                self.limited += 1
+        time.sleep(delay)
+        if limited:
+            return 429, {"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method == "exportChatInviteLink":
+            return 200, {"ok": True, "result": "https://t.me/+loadgen"}
+        if method == "sendMediaGroup":
+            media = json.loads(params.get("media") or "[]")
+            return 200, {"ok": True, "result": [self.message(params, photo=True) for _ in media]}
+        if method in self.SEND_METHODS:
+            return 200, {"ok": True, "result": self.message(params, photo=method == "sendPhoto")}
+        return 200, {"ok": True, "result": True}
+
+    def message(self, params, photo=False):
+        chat_id = int(params.get("chat_id") or 0)
+        with self.lock:
+            self.next_message_id += 1
+            message_id = self.next_message_id
+            text = params.get("text", "")
+            if chat_id < 0 and text.startswith(("Support message", "Admin request", "📥 Support digest")):
+                self.last_ticket[chat_id] = (message_id, text.startswith("📥"))
+        message = {"message_id": message_id, "date": int(time.time()), "from": BOT_USER,
+                   "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}}
+        if photo:
+            message["photo"] = [{"file_id": f"photo{message_id}", "file_unique_id": f"u{message_id}",
+                                 "width": 1280, "height": 720}]
+        else:
+            message["text"] = params.get("text", "")
+        return message
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip():
+            mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {"login", "profile", "leaderboard", "support", "reply"}
+    if unknown:
+        raise ValueError(f"unknown traffic kinds: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class TrafficGenerator:
+    # Update dicts as getUpdates would return them. Multi-step flows (/login then
+    # the name, /support then the text) stay in order because a chat always
+    # lands on the same worker lane.
+    def __init__(self, users, accounts, mix, seed=1):
+        self.rng = random.Random(seed)
+        self.users = [benchmark.USER_CHAT_BASE + i for i in range(users)]
+        self.accounts = accounts
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.logged_in = set()
+        self.update_id = 0
+
+    def __iter__(self):
+        while True:
+            yield from self.action(self.rng.choices(self.kinds, self.weights)[0])
+
+    def action(self, kind):
+        chat_id = self.rng.choice(self.users)
+        if kind == "reply":
+            # an admin answering in the support group; which message it answers
+            # is only known while feeding, see Feeder.bind
+            return [self.update(SUPPORT_GROUP_ID, "Thanks, we are looking into it", sender=benchmark.ADMIN_ID,
+                                reply_to=0)]
+        if kind == "support":
+            return [self.update(chat_id, "/support"),
+                    self.update(chat_id, f"My account {self.rng.randint(1, self.accounts)} lost its gems")]
+        updates = []
+        if kind == "login" or chat_id not in self.logged_in:
+            updates += [self.update(chat_id, "/login"),
+                        self.update(chat_id, f"player{self.rng.randint(1, self.accounts)}")]
+            self.logged_in.add(chat_id)
+        if kind == "profile":
+            updates.append(self.update(chat_id, "/profile"))
+        elif kind == "leaderboard":
+            if self.rng.random() < 0.5:
+                updates.append(self.update(chat_id, "/leaderboard"))
+            else:
+                field = self.rng.choice(["trophies", "gems", "solo", "duo", "3v3"])
+                updates.append(self.update(chat_id, f"/leaderboard {field} {self.rng.randint(1, 20)}"))
+        return updates
+
+    def update(self, chat_id, text, sender=None, reply_to=None):
+        self.update_id += 1
+        sender = sender or chat_id
+        message = {
+            "message_id": self.update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": {"id": sender, "is_bot": False, "first_name": "Load", "username": f"load{sender}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if reply_to is not None:
+            message["reply_to_message"] = {"message_id": reply_to, "date": int(time.time()), "from": BOT_USER,
+                                           "chat": message["chat"], "text": "Support message"}
+        return {"update_id": self.update_id, "message": message}
+
+
+def replay(path):
+    while True:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class LatencyProbe:
+    # wraps the lane pool's put() so every handler call records its queue wait
+    # and run time; backlog = handed to the pool but not finished yet
+    def __init__(self, pool):
+        self.pool = pool
+        self.put = pool.put
+        self.lock = threading.Lock()
+        self.samples = []   # (queue wait, handler seconds)
+        self.submitted = 0
+        self.completed = 0
+        pool.put = self.timed_put
+
+    def timed_put(self, func, *args, **kwargs):
+        queued = time.perf_counter()
+
+        def timed(*a, **k):
+            started = time.perf_counter()
+            try:
+                return func(*a, **k)
+            finally:
+                finished = time.perf_counter()
+                with self.lock:
+                    self.samples.append((started - queued, finished - started))
+                    self.completed += 1
+
+        with self.lock:
+            self.submitted += 1
+        self.put(timed, *args, **kwargs)
+
+    def backlog(self):
+        with self.lock:
+            return self.submitted - self.completed
+
+    def take(self):
+        with self.lock:
+            samples, self.samples = self.samples, []
+            return samples
+
+
+class Feeder:
+    TICK = 0.01
+
+    def __init__(self, bot, api, stream, record=None):
+        self.bot = bot
+        self.api = api
+        self.stream = iter(stream)
+        self.record = record
+
+    def bind(self, update):
+        # point generated support-group replies at the latest ticket the bot
+        # actually forwarded there (ticket #1 of a digest), so they go through
+        # the real reply routing
+        reply = update.get("message", {}).get("reply_to_message")
+        if reply is not None and not reply.get("message_id"):
+            message_id, digest = self.api.last_ticket.get(update["message"]["chat"]["id"], (1, False))
+            reply["message_id"] = message_id
+            if digest:
+                update["message"]["text"] = "#1 " + update["message"]["text"]
+        return update
+
+    def run(self, rate, duration, probe):
+        started = time.perf_counter()
+        fed = 0
+        backlog = [(0.0, probe.backlog())]
+        next_sample = 0.5
+        while True:
+            elapsed = time.perf_counter() - started
+            if elapsed >= duration:
+                break
+            due = int(rate * elapsed) - fed
+            if due > 0:
+                batch = [next(self.stream) for _ in range(due)]
+                if self.record is not None:
+                    for update in batch:
+                        self.record.write(json.dumps(update) + "\n")
+                self.bot.bot.process_new_updates([telebot.types.Update.de_json(self.bind(update)) for update in batch])
+                fed += due
+            if elapsed >= next_sample:
+                backlog.append((elapsed, probe.backlog()))
+                next_sample += 0.5
+            time.sleep(self.TICK)
+        backlog.append((time.perf_counter() - started, probe.backlog()))
+        return fed, time.perf_counter() - started, backlog
+
+
+def backlog_growth(backlog):
+    # least-squares slope of backlog over time, in updates per second
+    if len(backlog) < 2:
+        return 0.0
+    n = len(backlog)
+    mean_t = sum(t for t, _ in backlog) / n
+    mean_b = sum(b for _, b in backlog) / n
+    var = sum((t - mean_t) ** 2 for t, _ in backlog)
+    return sum((t - mean_t) * (b - mean_b) for t, b in backlog) / var if var else 0.0
+
+
+def counter_total(counters, name):
+    return sum(value for (key, _), value in counters.items() if key == name)
+
+
+def run_step(feeder, probe, rate, duration, drain_timeout):
+    probe.take()
+    counters_before, _ = tgbot.METRICS.snapshot()
+    completed_before = probe.completed
+    fed, elapsed, backlog = feeder.run(rate, duration, probe)
+    completed = probe.completed - completed_before
+    # let the queues empty so the next step starts from zero backlog
+    drain_started = time.perf_counter()
+    while probe.backlog() and time.perf_counter() - drain_started < drain_timeout:
+        time.sleep(0.05)
+    drain = time.perf_counter() - drain_started
+    counters_after, _ = tgbot.METRICS.snapshot()
+    samples = probe.take()
+    waits = sorted(wait for wait, _ in samples)
+    handler = sorted(run for _, run in samples)
+    total = sorted(wait + run for wait, run in samples)
+
+    def delta(name):
+        return counter_total(counters_after, name) - counter_total(counters_before, name)
+
+    return {
+        "rate": rate,
+        "fed": fed / elapsed,
+        "done": completed / elapsed,
+        "handler_p50": benchmark.percentile(handler, 50) * 1000,
+        "handler_p99": benchmark.percentile(handler, 99) * 1000,
+        "e2e_p50": benchmark.percentile(total, 50) * 1000,
+        "e2e_p99": benchmark.percentile(total, 99) * 1000,
+        "wait_max": (waits[-1] if waits else 0.0) * 1000,
+        "backlog_end": backlog[-1][1],
+        "backlog_max": max(b for _, b in backlog),
+        "growth": backlog_growth(backlog),
+        "drain": drain,
+        "drained": probe.backlog() == 0,
+        "sends": delta("tgbot_send_calls_total"),
+        "rate_limited": delta("tgbot_send_rate_limited_total"),
+        "errors": delta("tgbot_handler_errors_total"),
+    }
+
+
+def sustained(result):
+    # keeping up: the backlog is not trending upwards by more than 5% of the offered rate
+    return result["drained"] and result["growth"] <= max(1.0, 0.05 * result["rate"])
+
+
+def print_report(results, out):
+    out.write(f"\n{'rate/s':>7}{'fed/s':>8}{'done/s':>8}{'hdl p50':>9}{'hdl p99':>9}{'e2e p50':>9}{'e2e p99':>9}"
+              f"{'backlog':>9}{'growth/s':>10}{'drain s':>9}{'sends':>7}{'429s':>6}{'errors':>7}  ok\n")
+    for r in results:
+        out.write(f"{r['rate']:>7g}{r['fed']:>8.1f}{r['done']:>8.1f}{r['handler_p50']:>9.1f}{r['handler_p99']:>9.1f}"
+                  f"{r['e2e_p50']:>9.1f}{r['e2e_p99']:>9.1f}{r['backlog_max']:>9}{r['growth']:>10.1f}"
+                  f"{r['drain']:>9.1f}{r['sends']:>7}{r['rate_limited']:>6}{r['errors']:>7}"
+                  f"  {'yes' if sustained(r) else 'NO'}\n")
+    kept_up = [r["rate"] for r in results if sustained(r)]
+    if kept_up:
+        out.write(f"sustained up to {max(kept_up):g} updates/s (latencies in ms, backlog = max queued handler calls)\n")
+    else:
+        out.write("the backlog grew at every rate tried (latencies in ms)\n")
+    out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay Telegram updates into the bot against a fake Bot API")
+    parser.add_argument("--rates", default="10,25,50,100", help="comma separated update rates per second, one step each")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per rate step")
+    parser.add_argument("--users", type=int, default=500, help="distinct chats in the generated stream")
+    parser.add_argument("--accounts", type=int, default=10000, help="accounts in the generated database")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="traffic weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--api-latency", type=float, default=50, help="median fake Bot API latency in ms")
+    parser.add_argument("--api-429", type=float, default=0.01, help="share of sends answered with 429")
+    parser.add_argument("--replay", help="JSON lines file of Update objects to feed instead of generated traffic")
+    parser.add_argument("--record", help="write every fed update to this JSON lines file")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="max seconds to wait for queues between steps")
+    parser.add_argument("--accounts-mode", choices=["memory", "streaming"], default="memory")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--json", help="also write raw results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the generated database directory")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's error log (429s are logged per call)")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING if args.verbose else logging.CRITICAL)
+    telebot.logger.setLevel(logging.WARNING if args.verbose else logging.CRITICAL)
+
+    rates = [float(x) for x in args.rates.split(",") if x.strip()]
+    stream = replay(args.replay) if args.replay else TrafficGenerator(args.users, args.accounts, parse_mix(args.mix))
+    api = FakeBotAPI(latency=args.api_latency / 1000, rate_limited=args.api_429)
+    api.start()
+    directory = tempfile.mkdtemp(prefix="zerux-loadgen-")
+    cwd = os.getcwd()
+    record = open(args.record, "w", encoding="utf-8") if args.record else None
+    results = []
+    try:
+        benchmark.generate_database(directory, args.accounts, accounts_mode=args.accounts_mode, storage=args.storage)
+        os.chdir(directory)
+        bot = tgbot.TelegramBot(BOT_TOKEN)
+        if not isinstance(getattr(bot.bot, "worker_pool", None), tgbot.ChatLanePool):
+            raise SystemExit("the bot is not using the worker lane pool, nothing to measure")
+        probe = LatencyProbe(bot.bot.worker_pool)
+        feeder = Feeder(bot, api, stream, record)
+        for rate in rates:
+            result = run_step(feeder, probe, rate, args.duration, args.drain_timeout)
+            results.append(result)
+            print(f"{rate:g}/s: {result['done']:.1f} done/s, p99 {result['e2e_p99']:.0f} ms, "
+                  f"backlog max {result['backlog_max']}", flush=True)
+        bot.shutdown()
+    finally:
+        os.chdir(cwd)
+        if record is not None:
+            record.close()
+        api.close()
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    print_report(results, sys.stdout)
+    print(f"fake Bot API: {sum(api.calls.values())} calls, {api.limited} answered with 429")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+# -------------------------
+# One-shot migration of accounts.json / club.db into the SQLite storage
+# backend, and a check that the database holds exactly what the JSON files do.
+# accounts.json is streamed record by record, so big files don't need to fit
+# in memory.
+#
+#   python migrate_db.py migrate
+#   python migrate_db.py verify
+#
+# Afterwards set "storage": "sqlite" in server_config.json.
+# -------------------------
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tgbot
+
+BATCH = 5000
+
+
+def club_rows(clubs_path):
+    # (clubID, group, club) the same way ClubIndex flattens club.db
+    club_db = tgbot.load_club_db(clubs_path) if os.path.exists(clubs_path) else {}
+    seen = set()
+    for group_name, group in club_db.items():
+        if not isinstance(group, dict):
+            continue
+        for club in group.values():
+            if isinstance(club, dict) and club.get("clubID") is not None and str(club.get("clubID")) not in seen:
+                seen.add(str(club.get("clubID")))
+                yield str(club.get("clubID")), group_name, club
+
+
+def iter_accounts(accounts_path):
+    if not os.path.exists(accounts_path):
+        return
+    with open(accounts_path, "rb") as f:
+        for account_id, _, _, account in tgbot.scan_account_records(f):
+            yield account_id, account
+
+
+def migrate(accounts_path, clubs_path, db_path, force=False):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    db = sqlite3.connect(db_path)
+    tgbot.create_sqlite_schema(db)
+    existing = db.execute("SELECT (SELECT COUNT(*) FROM accounts) + (SELECT COUNT(*) FROM clubs)").fetchone()[0]
+    if existing and not force:
+        print(f"{db_path} already has data; use --force to replace it")
+        return 1
+    db.execute("DELETE FROM accounts")
+    db.execute("DELETE FROM clubs")
+    insert = tgbot.account_row_sql()
+    batch = []
+    accounts = 0
+    for account_id, account in iter_accounts(accounts_path):
+        batch.append(tgbot.account_row(account_id, account))
+        accounts += 1
+        if len(batch) >= BATCH:
+            db.executemany(insert, batch)
+            batch = []
+    db.executemany(insert, batch)
+    clubs = 0
+    for club_id, group_name, club in club_rows(clubs_path):
+        db.execute("INSERT OR REPLACE INTO clubs (id, grp, data) VALUES (?, ?, ?)", (club_id, group_name, json.dumps(club)))
+        clubs += 1
+    db.commit()
+    db.close()
+    print(f"Migrated {accounts} accounts and {clubs} clubs into {db_path}")
+    return 0
+
+
+def verify(accounts_path, clubs_path, db_path, max_errors=20):
+    if not os.path.exists(db_path):
+        print(f"{db_path} does not exist")
+        return 1
+    db = sqlite3.connect(db_path)
+    errors = []
+    expected = 0
+    for account_id, account in iter_accounts(accounts_path):
+        expected += 1
+        row = db.execute("SELECT data FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        if row is None:
+            errors.append(f"account {account_id}: missing")
+        elif json.loads(row[0]) != account:
+            errors.append(f"account {account_id}: data differs")
+    stored = db.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+    if stored != expected:
+        errors.append(f"accounts: {expected} in JSON, {stored} in database")
+    clubs = 0
+    for club_id, group_name, club in club_rows(clubs_path):
+        clubs += 1
+        row = db.execute("SELECT data FROM clubs WHERE id = ?", (club_id,)).fetchone()
+        if row is None:
+            errors.append(f"club {club_id}: missing")
+        elif json.loads(row[0]) != club:
+            errors.append(f"club {club_id}: data differs")
+    stored_clubs = db.execute("SELECT COUNT(*) FROM clubs").fetchone()[0]
+    if stored_clubs != clubs:
+        errors.append(f"clubs: {clubs} in JSON, {stored_clubs} in database")
+    db.close()
+    for error in errors[:max_errors]:
+        print(error)
+    if len(errors) > max_errors:
+        print(f"... and {len(errors) - max_errors} more")
+    if errors:
+        print(f"Verify FAILED: {len(errors)} problems")
+        return 1
+    print(f"Verify OK: {expected} accounts and {clubs} clubs match")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move accounts.json / club.db into the SQLite storage backend")
+    parser.add_argument("command", choices=["migrate", "verify"])
+    parser.add_argument("--accounts", default=tgbot.ACCOUNTS_PATH, help="accounts.json to read")
+    parser.add_argument("--clubs", default=tgbot.CLUB_DB_PATH, help="club.db to read")
+    parser.add_argument("--db", default=tgbot.SQLITE_DB_PATH, help="SQLite database to write or check")
+    parser.add_argument("--force", action="store_true", help="replace data already in the database")
+    args = parser.parse_args(argv)
+    if args.command == "migrate":
+        return migrate(args.accounts, args.clubs, args.db, args.force)
+    return verify(args.accounts, args.clubs, args.db)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
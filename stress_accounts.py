@@ -0,0 +1,107 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# -------------------------
+# Two writer processes hammering the same accounts.json: a "server" doing the
+# game server's locked read-modify-write of trophies, and the bot's AccountStore
+# adding gems. Afterwards every increment from both sides must be in the file.
+#
+#   python stress_accounts.py --accounts 2000 --updates 500
+#   python stress_accounts.py --accounts-mode streaming
+#   python stress_accounts.py --unsafe      # old unlocked writes, loses updates
+# -------------------------
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tgbot
+
+
+def server_writer(path, account_ids, updates, unsafe):
+    lock = tgbot.FileLock(path)
+    for i in range(updates):
+        account_id = account_ids[i % len(account_ids)]
+        if unsafe:
+            data = tgbot.load_accounts(path)
+            data["Accounts"][account_id]["trophies"] += 1
+            tgbot.save_accounts(data, path)
+        else:
+            with lock:
+                data = tgbot.load_accounts(path)
+                data["Accounts"][account_id]["trophies"] += 1
+                tgbot.write_json_atomic(path, data)
+
+
+def bot_writer(path, account_ids, updates, unsafe, flush_interval, accounts_mode):
+    if unsafe:
+        for i in range(updates):
+            account_id = account_ids[i % len(account_ids)]
+            data = tgbot.load_accounts(path)
+            data["Accounts"][account_id]["gems"] += 1
+            tgbot.save_accounts(data, path)
+        return
+    if accounts_mode == "streaming":
+        store = tgbot.StreamingAccountStore(path, path + ".index.sqlite", flush_interval=flush_interval)
+    else:
+        store = tgbot.AccountStore(path, flush_interval=flush_interval)
+    store.refresh()
+    for i in range(updates):
+        account_id = account_ids[i % len(account_ids)]
+        # same shape as /addgems: the bot owns gems, the server owns trophies
+        store.update(account_id, {"gems": store.get(account_id)["gems"] + 1})
+        time.sleep(flush_interval / 4)
+    store.close()
+    print(f"bot: {tgbot.METRICS.counters.get(('tgbot_account_write_conflicts_total', ()), 0)} write conflicts retried")
+
+
+def run(accounts, updates, unsafe, flush_interval, accounts_mode="memory"):
+    directory = tempfile.mkdtemp(prefix="zerux-stress-")
+    path = os.path.join(directory, "accounts.json")
+    try:
+        account_ids = [str(i) for i in range(1, accounts + 1)]
+        tgbot.write_json_atomic(path, {"Accounts": {account_id: {"name": f"player{account_id}", "lowID": int(account_id),
+                                                                 "trophies": 0, "gems": 0}
+                                                    for account_id in account_ids}})
+        # both writers touch the same few accounts so their writes overlap
+        hot = account_ids[:10]
+        started = time.perf_counter()
+        writers = [multiprocessing.Process(target=server_writer, args=(path, hot, updates, unsafe)),
+                   multiprocessing.Process(target=bot_writer, args=(path, hot, updates, unsafe, flush_interval,
+                                                                    accounts_mode))]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        elapsed = time.perf_counter() - started
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)["Accounts"]
+        trophies = sum(account["trophies"] for account in data.values())
+        gems = sum(account["gems"] for account in data.values())
+        print(f"{elapsed:.1f}s: trophies {trophies}/{updates}, gems {gems}/{updates}, accounts {len(data)}/{accounts}")
+        if trophies != updates or gems != updates or len(data) != accounts:
+            print("FAILED: updates were lost")
+            return 1
+        print("OK: no updates lost")
+        return 0
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent writers against one accounts.json")
+    parser.add_argument("--accounts", type=int, default=2000, help="accounts in the generated file")
+    parser.add_argument("--updates", type=int, default=500, help="increments per writer")
+    parser.add_argument("--flush-interval", type=float, default=0.01, help="AccountStore flush interval")
+    parser.add_argument("--accounts-mode", choices=["memory", "streaming"], default="memory",
+                        help="account store the bot side uses")
+    parser.add_argument("--unsafe", action="store_true", help="use plain load/save without locks or conflict checks")
+    args = parser.parse_args(argv)
+    return run(args.accounts, args.updates, args.unsafe, args.flush_interval, args.accounts_mode)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
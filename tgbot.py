@@ -5,100 +5,2949 @@ import time
 import psutil
 import os
 import shutil
+import threading
+import bisect
+import tempfile
+import atexit
+import queue
+import hmac
+import html
+import secrets
+import heapq
+import csv
+import io
+import re
+import sqlite3
+import zlib
+import contextlib
+try:
+    import fcntl
+except ImportError:   # Windows: no advisory locks, writes fall back to the optimistic check only
+    fcntl = None
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from collections import OrderedDict, deque
 
+ACCOUNTS_PATH = "Database/Player/accounts.json"
+CLUB_DB_PATH = "Database/Club/club.db"
+USERS_LOG_PATH = "JSON/users.log"
+FORWARDED_LOG_PATH = "JSON/forwarded_messages.log"
+FORWARDED_LEGACY_PATH = "JSON/forwarded_messages.json"
+ACCOUNTS_INDEX_PATH = "JSON/accounts_index.sqlite"
+SQLITE_DB_PATH = "Database/database.sqlite"
+
+# -------------------------
+# Helper Functions
+# -------------------------
+def load_server_config():
+    try:
+        with open('server_config.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading server config: {e}")
+        return {}
+
+def load_user_config():
+    try:
+        with open('config.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading user config: {e}")
+        return {}
+
+def save_user_config(user_config):
+    try:
+        write_json_atomic('config.json', user_config, indent=4)
+    except Exception as e:
+        logging.error(f"Error saving user config: {e}")
+
+def load_accounts(path=ACCOUNTS_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading accounts: {e}")
+        return {}
+
+def save_accounts(accounts_data, path=ACCOUNTS_PATH):
+    try:
+        write_json_atomic(path, accounts_data)
+        return True
+    except Exception as e:
+        logging.error(f"Error saving accounts: {e}")
+        return False
+
+def write_json_atomic(path, data, indent=None):
+    # write next to the target and swap it in, so readers never see half a file
+    tmp_path = write_json_temp(path, data, indent)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+
+def write_json_temp(path, data, indent=None):
+    # fully written and fsynced temp file next to `path`, ready for os.replace
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            if indent is None:
+                json.dump(data, f, separators=(",", ":"))
+            else:
+                json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    return tmp_path
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class FileLock:
+    # Advisory lock shared with the game server: flock() on "<path>.lock", which
+    # unlike the data file is never replaced. Re-entrant within this process.
+    # The game server should hold it for its own read-modify-write of the file:
+    #     with FileLock("Database/Player/accounts.json"):
+    #         data = load_accounts(); ...; write_json_atomic(ACCOUNTS_PATH, data)
+    def __init__(self, path):
+        self.path = path + ".lock"
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.fd = None
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        if self.depth == 0 and fcntl is not None:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            except BaseException:
+                if self.fd is not None:
+                    os.close(self.fd)
+                    self.fd = None
+                self.lock.release()
+                raise
+        self.depth += 1
+        METRICS.observe("tgbot_file_lock_wait_seconds", time.perf_counter() - started)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0 and self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+        self.lock.release()
+
+def file_signature(path):
+    # (mtime, size, inode) of a file, or None if it does not exist; the inode
+    # changes on every atomic replace even when mtime and size look the same
+    try:
+        return stat_signature(os.stat(path))
+    except OSError:
+        return None
+
+def stat_signature(st):
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def get_system_stats(sample):
+    return (
+        f"💾 RAM Usage: {sample['ram']}%\n"
+        f"⚙️ CPU Usage: {sample['cpu']}%\n"
+        f"🖴 Disk Usage: {sample['disk']}%\n"
+        f"🌐 Network: ↑ {sample['net_sent'] / 1024:.1f} KB/s ↓ {sample['net_recv'] / 1024:.1f} KB/s\n"
+        f"🤖 Bot Memory: {sample['rss'] / (1024 * 1024):.1f} MB"
+    )
+
+def is_admin(chat_id, admin_ids):
+    # admin_ids is normally ConfigManager.admin_ids, a precomputed set of strings
+    if not isinstance(admin_ids, (set, frozenset)):
+        admin_ids = {str(x) for x in admin_ids}
+    return str(chat_id) in admin_ids
+
+def load_club_db(path=CLUB_DB_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading club database: {e}")
+        return {}
+
+# -------------------------
+# Metrics
+# In-process counters and fixed-bucket latency histograms, rendered in the
+# Prometheus text format. Gauge callbacks are evaluated at render time.
+# -------------------------
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}     # (name, labels) -> value
+        self.histograms = {}   # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.gauges = {}       # owner name -> callable returning [(name, labels, value), ...]
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels=()):
+        key = (name, labels)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += seconds
+
+    def wrap(self, name, func, labels=()):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                self.inc(f"{name}_errors_total", labels + (("exception", type(e).__name__),))
+                raise
+            finally:
+                self.inc(f"{name}_calls_total", labels)
+                self.observe(f"{name}_latency_seconds", time.perf_counter() - started, labels)
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def gauge(self, owner, func):
+        # registering the same owner again replaces it, so a second bot in the
+        # process doesn't repeat every series
+        with self.lock:
+            self.gauges[owner] = func
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters), {key: list(value) for key, value in self.histograms.items()}
+
+    def quantile(self, histogram, q):
+        count = sum(histogram[:-1])
+        if not count:
+            return 0.0
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), histogram[:-1]):
+            running += bucket_count
+            if running >= q * count:
+                return bound
+        return float("inf")
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+    def render_prometheus(self):
+        counters, histograms = self.snapshot()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in counters.items():
+                if metric == name:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in histograms.items():
+                if metric != name:
+                    continue
+                running = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), histogram[:-1]):
+                    running += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', le),))} {running}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self._labels(labels)} {running}")
+        with self.lock:
+            callbacks = list(self.gauges.values())
+        gauges = {}
+        for gauge in callbacks:
+            try:
+                for name, labels, value in gauge():
+                    gauges.setdefault(name, []).append((labels, value))
+            except Exception as e:
+                logging.error(f"Error reading gauge: {e}")
+        for name, samples in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+def timed_load(file_label, loader, path):
+    started = time.perf_counter()
+    try:
+        return loader(path)
+    finally:
+        METRICS.observe("tgbot_file_load_seconds", time.perf_counter() - started, (("file", file_label),))
+
+# -------------------------
+# Configuration
+# server_config.json and config.json are parsed once and kept in memory.
+# A background thread polls their mtime/size and swaps in a new dict when a
+# file changes and passes validation; a bad edit keeps the last good config.
+# -------------------------
+def validate_server_config(data):
+    if not isinstance(data, dict):
+        raise ValueError("server config must be a JSON object")
+    if not isinstance(data.get("admin_ids", []), list):
+        raise ValueError("admin_ids must be a list")
+    if not isinstance(data.get("support_group_id"), (str, int, type(None))):
+        raise ValueError("support_group_id must be a string or number")
+    for key in ("support_digest_interval", "support_digest_max"):
+        if not isinstance(data.get(key, 0), (int, float)) or isinstance(data.get(key), bool):
+            raise ValueError(f"{key} must be a number")
+    if not isinstance(data.get("support_urgent_keywords", []), list):
+        raise ValueError("support_urgent_keywords must be a list")
+
+def validate_user_config(data):
+    if not isinstance(data, dict):
+        raise ValueError("user config must be a JSON object")
+    if "ThemeID" in data and not isinstance(data["ThemeID"], int):
+        raise ValueError("ThemeID must be a number")
+    if "Maintenance" in data and not isinstance(data["Maintenance"], bool):
+        raise ValueError("Maintenance must be true or false")
+
+class ConfigFile:
+    def __init__(self, path, validate=None):
+        self.path = path
+        self.validate = validate
+        self.lock = threading.RLock()
+        self.data = {}        # replaced as a whole, never mutated in place
+        self.signature = None
+        self.loaded = False
+        self.callbacks = []   # called with the new dict after every swap
+        self.reload()
+
+    def reload(self):
+        # returns True if a new config was swapped in
+        signature = file_signature(self.path)
+        if self.loaded and signature == self.signature:
+            return False
+        with self.lock:
+            if self.loaded and signature == self.signature:
+                return False
+            try:
+                if signature is None:
+                    raise FileNotFoundError(self.path)
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if self.validate is not None:
+                    self.validate(data)
+            except Exception as e:
+                logging.error(f"Error loading {self.path}, keeping the previous config: {e}")
+                # don't retry the same broken file on every poll
+                self.signature = signature
+                self.loaded = True
+                return False
+            self._swap(data, signature)
+            return True
+
+    def _swap(self, data, signature):
+        self.data = data
+        self.signature = signature
+        self.loaded = True
+        for callback in self.callbacks:
+            callback(data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def update(self, changes):
+        with self.lock:
+            self.reload()
+            data = dict(self.data)
+            data.update(changes)
+            if self.validate is not None:
+                self.validate(data)
+            write_json_atomic(self.path, data, indent=4)
+            self._swap(data, file_signature(self.path))
+
+class ConfigManager:
+    def __init__(self, server_path="server_config.json", user_path="config.json", poll_interval=None):
+        self.admin_ids = frozenset()
+        self.server = ConfigFile(server_path, validate_server_config)
+        self.server.callbacks.append(self._server_changed)
+        self._server_changed(self.server.data)
+        self.user = ConfigFile(user_path, validate_user_config)
+        if poll_interval is None:
+            poll_interval = self.server.get("config_poll_interval", 5)
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        if poll_interval and poll_interval > 0:
+            self.thread = threading.Thread(target=self._loop, name="config-watcher", daemon=True)
+            self.thread.start()
+
+    def _server_changed(self, data):
+        self.admin_ids = frozenset(str(x) for x in data.get("admin_ids", []))
+
+    def _loop(self):
+        while not self.stop_event.wait(self.poll_interval):
+            for config in (self.server, self.user):
+                try:
+                    if config.reload():
+                        logging.info(f"Reloaded {config.path}")
+                except Exception as e:
+                    logging.error(f"Error reloading {config.path}: {e}")
+
+    def close(self):
+        self.stop_event.set()
+
+# -------------------------
+# Account Store
+# Keeps accounts.json parsed in memory with name/lowID indexes and only
+# re-reads the file when its mtime or size changes (e.g. the game server saved).
+# Changes are coalesced and written as one compact snapshot per flush window.
+# -------------------------
+class FileAccountStore:
+    # accounts.json change detection, pending changes and the optimistic flush;
+    # subclasses hold the accounts: _load, _apply, _write, get, items, find_by_*
+    WRITE_ATTEMPTS = 3
+    RETRY_BASE = 1     # seconds before retrying a failed flush, doubled per failure
+    RETRY_MAX = 60
+
+    def __init__(self, path=ACCOUNTS_PATH, flush_interval=2.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(path)   # shared with the game server
+        self.signature = None
+        self.loaded = False
+        self.listeners = []   # objects with accounts_reloaded() / account_changed()
+        self.pending = {}     # account id -> {field: value} not yet written
+        self.flush_timer = None
+        self.flush_failures = 0
+        self.closed = False
+
+    def refresh(self):
+        signature = file_signature(self.path)
+        if self.loaded and signature == self.signature:
+            return
+        with self.lock:
+            if self.loaded and signature == self.signature:
+                return
+            self._load(signature)
+
+    def update(self, account_id, changes):
+        self.refresh()
+        with self.lock:
+            account = self._apply(account_id, changes)
+            if account is not None:
+                self._schedule_flush()
+            return account
+
+    def update_many(self, changes_by_account):
+        # one pass, one flush for a whole batch; returns how many accounts changed
+        self.refresh()
+        with self.lock:
+            updated = sum(1 for account_id, changes in changes_by_account.items()
+                          if self._apply(account_id, changes) is not None)
+            if updated:
+                self._schedule_flush()
+            return updated
+
+    def _schedule_flush(self, delay=None):
+        if delay is None and self.flush_interval <= 0:
+            self.flush()
+            return
+        if self.flush_timer is None and not self.closed:
+            self.flush_timer = threading.Timer(self.flush_interval if delay is None else delay, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
+
+    def flush(self):
+        # Optimistic write: build the new file without holding the file lock,
+        # then lock only to check nobody replaced it meanwhile and rename. If the
+        # game server did, reload it, re-apply our pending fields and try again.
+        with self.lock:
+            self.flush_timer = None
+            for attempt in range(self.WRITE_ATTEMPTS):
+                # the last attempt keeps the file locked from reload to rename, so it can't lose again
+                final = attempt == self.WRITE_ATTEMPTS - 1
+                with self.file_lock if final else contextlib.nullcontext():
+                    if not self.pending:
+                        return
+                    try:
+                        signature = file_signature(self.path)
+                        if signature != self.signature:
+                            self._load(signature)
+                            if not self.pending:
+                                return
+                        if self._write():
+                            self.pending.clear()
+                            self.flush_failures = 0
+                            return
+                    except Exception as e:
+                        self._retry_flush(e)
+                        return
+                METRICS.inc("tgbot_account_write_conflicts_total")
+            self._retry_flush("still conflicting after the last attempt")
+
+    def _retry_flush(self, error):
+        # pending changes stay in memory; try again later instead of waiting for the next update
+        self.flush_failures += 1
+        delay = min(self.RETRY_MAX, self.RETRY_BASE * 2 ** (self.flush_failures - 1))
+        logging.error(f"Error saving accounts, retrying in {delay}s: {error}")
+        METRICS.inc("tgbot_account_write_failures_total")
+        self._schedule_flush(delay)
+
+    def _replace(self, tmp_path):
+        # swap tmp_path in only if the file is still the version we built on
+        with self.file_lock:
+            if file_signature(self.path) != self.signature:
+                remove_quietly(tmp_path)
+                return False
+            try:
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                remove_quietly(tmp_path)
+                raise
+            self.signature = file_signature(self.path)
+            return True
+
+    def discard_pending(self):
+        with self.lock:
+            self.pending.clear()
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+            self.flush()
+
+class AccountStore(FileAccountStore):
+    # the whole file parsed in memory, with name and lowID indexes
+    def __init__(self, path=ACCOUNTS_PATH, flush_interval=2.0):
+        super().__init__(path, flush_interval)
+        self.data = {}
+        self.by_name = {}     # account name -> account id
+        self.by_lowid = {}    # str(lowID) -> account id
+
+    def _load(self, signature):
+        data = timed_load("accounts", load_accounts, self.path) if signature is not None else {}
+        accounts = data.get("Accounts", {})
+        # someone else wrote the file: keep our unsaved changes on top of it
+        for account_id in list(self.pending):
+            if account_id in accounts:
+                accounts[account_id].update(self.pending[account_id])
+            else:
+                del self.pending[account_id]
+        by_name, by_lowid = {}, {}
+        for account_id, account in accounts.items():
+            # first match wins, same as the old linear scans
+            by_name.setdefault(account.get("name"), account_id)
+            if account.get("lowID") is not None:
+                by_lowid.setdefault(str(account.get("lowID")), account_id)
+        self.data = data
+        self.by_name = by_name
+        self.by_lowid = by_lowid
+        self.signature = signature
+        self.loaded = True
+        for listener in self.listeners:
+            listener.accounts_reloaded(accounts)
+
+    def accounts(self):
+        self.refresh()
+        return self.data.get("Accounts", {})
+
+    def get(self, account_id):
+        return self.accounts().get(account_id)
+
+    def items(self):
+        return list(self.accounts().items())
+
+    def find_by_name(self, name):
+        accounts = self.accounts()
+        account_id = self.by_name.get(name)
+        if account_id is None:
+            return None, None
+        return account_id, accounts.get(account_id)
+
+    def find_by_lowid(self, low_id):
+        accounts = self.accounts()
+        account_id = self.by_lowid.get(str(low_id))
+        if account_id is None:
+            return None, None
+        return account_id, accounts.get(account_id)
+
+    def _apply(self, account_id, changes):
+        account = self.data.get("Accounts", {}).get(account_id)
+        if account is None:
+            return None
+        if "name" in changes and changes["name"] != account.get("name"):
+            if self.by_name.get(account.get("name")) == account_id:
+                del self.by_name[account.get("name")]
+            self.by_name.setdefault(changes["name"], account_id)
+        account.update(changes)
+        self.pending.setdefault(account_id, {}).update(changes)
+        for listener in self.listeners:
+            listener.account_changed(account_id, account)
+        return account
+
+    def _write(self):
+        return self._replace(write_json_temp(self.path, self.data))
+
+
+# -------------------------
+# Club Index
+# clubID -> club entry from club.db, rebuilt only when the file changes.
+# -------------------------
+class ClubIndex:
+    def __init__(self, path=CLUB_DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.clubs = {}     # str(clubID) -> club
+        self.signature = None
+        self.loaded = False
+
+    def refresh(self):
+        signature = file_signature(self.path)
+        if self.loaded and signature == self.signature:
+            return
+        with self.lock:
+            if self.loaded and signature == self.signature:
+                return
+            club_db = timed_load("club_db", load_club_db, self.path) if signature is not None else {}
+            clubs = {}
+            for group in club_db.values():
+                if not isinstance(group, dict):
+                    continue
+                for club in group.values():
+                    if isinstance(club, dict) and club.get("clubID") is not None:
+                        clubs.setdefault(str(club.get("clubID")), club)
+            self.clubs = clubs
+            self.signature = signature
+            self.loaded = True
+
+    def get(self, club_id):
+        self.refresh()
+        return self.clubs.get(str(club_id))
+
+# -------------------------
+# Leaderboard
+# Accounts kept sorted by one field so /leaderboard never sorts the whole DB.
+# Single account changes are a bisect remove + insert; reloads only touch the
+# accounts whose value actually changed.
+# -------------------------
+def metric_value(account, field):
+    value = account.get(field, 0)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return 0
+    return value
+
+class Leaderboard:
+    # above this share of changed accounts a reload just re-sorts everything
+    REBUILD_RATIO = 0.25
+
+    def __init__(self, field):
+        self.field = field
+        self.lock = threading.Lock()
+        self.entries = []   # sorted (-value, account_id)
+        self.values = {}    # account_id -> value
+
+    def rebuild(self, accounts):
+        values = {account_id: metric_value(account, self.field) for account_id, account in accounts.items()}
+        entries = sorted((-value, account_id) for account_id, value in values.items())
+        with self.lock:
+            self.values = values
+            self.entries = entries
+
+    def _remove(self, account_id):
+        old = self.values.pop(account_id, None)
+        if old is None:
+            return
+        i = bisect.bisect_left(self.entries, (-old, account_id))
+        if i < len(self.entries) and self.entries[i] == (-old, account_id):
+            del self.entries[i]
+
+    def _set(self, account_id, value):
+        if self.values.get(account_id) == value:
+            return
+        self._remove(account_id)
+        self.values[account_id] = value
+        bisect.insort(self.entries, (-value, account_id))
+
+    def account_changed(self, account_id, account):
+        with self.lock:
+            self._set(account_id, metric_value(account, self.field))
+
+    def accounts_reloaded(self, accounts):
+        with self.lock:
+            removed = [account_id for account_id in self.values if account_id not in accounts]
+            changed = [(account_id, metric_value(account, self.field)) for account_id, account in accounts.items()
+                       if self.values.get(account_id) != metric_value(account, self.field)]
+            if len(removed) + len(changed) <= len(accounts) * self.REBUILD_RATIO:
+                for account_id in removed:
+                    self._remove(account_id)
+                for account_id, value in changed:
+                    self._set(account_id, value)
+                return
+        self.rebuild(accounts)
+
+    def top(self, count):
+        return self.slice(0, count)
+
+    def slice(self, start, stop):
+        with self.lock:
+            return [(account_id, -negated) for negated, account_id in self.entries[start:stop]]
+
+    def rank(self, account_id):
+        # 1-based position, found by binary search on the account's own key
+        with self.lock:
+            value = self.values.get(account_id)
+            if value is None:
+                return None
+            return bisect.bisect_left(self.entries, (-value, account_id)) + 1
+
+    def __len__(self):
+        return len(self.entries)
+
+# alias -> (account field, label)
+RANKING_METRICS = {
+    "trophies": ("trophies", "trophies"),
+    "highest": ("highesttrophies", "highest trophies"),
+    "solo": ("soloWins", "solo wins"),
+    "duo": ("duoWins", "duo wins"),
+    "3v3": ("3vs3Wins", "3v3 wins"),
+    "gold": ("gold", "gold"),
+    "gems": ("gems", "gems"),
+}
+
+def resolve_metric(name):
+    name = name.lower()
+    if name in RANKING_METRICS:
+        return name
+    for alias, (field, label) in RANKING_METRICS.items():
+        if name == field.lower():
+            return alias
+    return None
+
+# -------------------------
+# Bulk Economy Changes
+# "name,field,value" rows or a filter, applied in one pass. A leading +/- on
+# the value means a relative change, otherwise the value is set as-is.
+# -------------------------
+BULK_FILTER_RE = re.compile(r"^where\s+(\S+?)\s*(>=|<=|!=|=|>|<)\s*(-?\d+)\s+set\s+(\S+)\s+([+-]?\d+)$", re.IGNORECASE)
+BULK_USAGE = (
+    "Usage:\n"
+    "/bulkset followed by one name,field,value row per line\n"
+    "/bulkset where <field> <op> <number> set <field> <value>\n"
+    "or upload a CSV file with the caption /bulkset\n"
+    "Values like +100 or -50 are relative, 100 sets the value."
+)
+BULK_OPERATORS = {
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+}
+
+def resolve_economy_field(name):
+    metric = resolve_metric(name)
+    return RANKING_METRICS[metric][0] if metric else None
+
+def parse_amount(text):
+    text = text.strip()
+    if not text.lstrip("+-").isdigit():
+        raise ValueError(f"invalid amount '{text}'")
+    return int(text), text[0] in "+-"
+
+def stage_amount(account, changes, field, amount, relative):
+    current = changes.get(field, metric_value(account, field))
+    value = max(0, current + amount) if relative else amount
+    changes[field] = value
+    # same rule as /addtrophy
+    if field == "trophies" and value > changes.get("highesttrophies", account.get("highesttrophies", 0)):
+        changes["highesttrophies"] = value
+
+def stage_bulk_rows(store, rows):
+    # rows: (line number, name, field, value) -> (changes by account id, not found names, errors)
+    changes_by_account = {}
+    not_found = []
+    errors = []
+    for line_no, name, field_name, value_text in rows:
+        if name is None:
+            errors.append(f"line {line_no}: expected name,field,value")
+            continue
+        field = resolve_economy_field(field_name)
+        if field is None:
+            errors.append(f"line {line_no}: unknown field '{field_name}'")
+            continue
+        try:
+            amount, relative = parse_amount(value_text)
+        except ValueError as e:
+            errors.append(f"line {line_no}: {e}")
+            continue
+        account_id, account = store.find_by_name(name)
+        if account_id is None:
+            not_found.append(name)
+            continue
+        stage_amount(account, changes_by_account.setdefault(account_id, {}), field, amount, relative)
+    return changes_by_account, not_found, errors
+
+def parse_bulk_rows(text):
+    rows = []
+    for line_no, row in enumerate(csv.reader(io.StringIO(text)), 1):
+        if not row or not "".join(row).strip():
+            continue
+        if line_no == 1 and [cell.strip().lower() for cell in row] == ["name", "field", "value"]:
+            continue
+        if len(row) != 3:
+            rows.append((line_no, None, None, None))
+            continue
+        rows.append((line_no, row[0].strip(), row[1].strip(), row[2].strip()))
+    return rows
+
+class Rankings:
+    PAGE_SIZE = 10
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.boards = {}    # field -> Leaderboard, built on first use
+        self.stale = set()  # fields that have not seen the latest reload yet
+        store.listeners.append(self)
+
+    def accounts_reloaded(self, accounts):
+        # boards catch up lazily on their next read, once per reload
+        with self.lock:
+            self.stale.update(self.boards)
+
+    def account_changed(self, account_id, account):
+        with self.lock:
+            boards = [board for field, board in self.boards.items() if field not in self.stale]
+        for board in boards:
+            board.account_changed(account_id, account)
+
+    def board(self, field):
+        accounts = self.store.accounts()
+        with self.lock:
+            board = self.boards.get(field)
+            if board is None:
+                board = Leaderboard(field)
+                board.rebuild(accounts)
+                self.boards[field] = board
+            elif field in self.stale:
+                board.accounts_reloaded(accounts)
+            self.stale.discard(field)
+            return board
+
+    def page(self, field, page):
+        board = self.board(field)
+        pages = max(1, -(-len(board) // self.PAGE_SIZE))
+        page = min(max(page, 1), pages)
+        start = (page - 1) * self.PAGE_SIZE
+        rows = [(start + idx, account_id, value) for idx, (account_id, value)
+                in enumerate(board.slice(start, start + self.PAGE_SIZE), 1)]
+        return rows, page, pages
+
+    def rank(self, field, account_id):
+        board = self.board(field)
+        position = board.rank(account_id)
+        if position is None:
+            return None
+        return position, board.values.get(account_id), len(board)
+
+# -------------------------
+# Streaming Account Store (accounts_mode "streaming")
+# Low-memory alternative to AccountStore for very large accounts.json files.
+# One streaming pass records each account's byte span plus its name, lowID and
+# ranking fields in an on-disk SQLite index; lookups then read just that span.
+# Per-block CRCs let a changed file be rescanned from the first changed block,
+# and flushes splice only the changed records into a new copy of the file.
+# -------------------------
+SCAN_CHUNK = 1 << 20
+INDEX_BLOCK = 1 << 20
+INDEX_METRICS = tuple(field for field, _ in RANKING_METRICS.values())
+JSON_WS_RE = re.compile(r"[ \t\n\r]*")
+JSON_DECODER = json.JSONDecoder()
+
+class JSONStreamReader:
+    # text is decoded as latin-1 so that string positions are byte offsets
+    def __init__(self, f, offset=0):
+        f.seek(offset)
+        self.f = f
+        self.base = offset   # byte offset of buf[0]
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        if self.pos:
+            self.base += self.pos
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        chunk = self.f.read(SCAN_CHUNK)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk.decode("latin-1")
+        return True
+
+    def peek(self):
+        while True:
+            self.pos = JSON_WS_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.more():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at byte {self.base + self.pos}")
+        self.pos += 1
+
+    def value(self):
+        # -> (value, start byte, end byte)
+        self.peek()
+        while True:
+            try:
+                value, end = JSON_DECODER.raw_decode(self.buf, self.pos)
+                # a value that touches the end of the buffer may be cut short (numbers)
+                if end < len(self.buf) or self.eof:
+                    break
+            except ValueError:
+                if self.eof:
+                    raise
+            self.more()
+        text = self.buf[self.pos:end]
+        if not text.isascii():
+            value = json.loads(text.encode("latin-1"))
+        start = self.base + self.pos
+        self.pos = end
+        return value, start, self.base + end
+
+def scan_account_records(f, offset=0, resume=False):
+    # yields (account_id, start, end, account) for every entry of "Accounts";
+    # resume=True continues right after a record at `offset`
+    reader = JSONStreamReader(f, offset)
+    if not resume:
+        reader.expect("{")
+        while True:
+            if reader.peek() in ("}", ""):
+                return
+            key, _, _ = reader.value()
+            reader.expect(":")
+            if key == "Accounts":
+                break
+            reader.value()
+            if reader.peek() == ",":
+                reader.pos += 1
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+    else:
+        if reader.peek() != ",":
+            return
+        reader.pos += 1
+    while True:
+        account_id, _, _ = reader.value()
+        reader.expect(":")
+        account, start, end = reader.value()
+        yield account_id, start, end, account
+        if reader.peek() != ",":
+            return
+        reader.pos += 1
+
+def block_checksums(f):
+    checksums = []
+    f.seek(0)
+    while True:
+        block = f.read(INDEX_BLOCK)
+        if not block:
+            return checksums
+        checksums.append(zlib.crc32(block))
+
+def copy_range(src, dst, start, stop=None):
+    src.seek(start)
+    remaining = None if stop is None else stop - start
+    while remaining is None or remaining > 0:
+        chunk = src.read(SCAN_CHUNK if remaining is None else min(SCAN_CHUNK, remaining))
+        if not chunk:
+            return
+        dst.write(chunk)
+        if remaining is not None:
+            remaining -= len(chunk)
+
+def index_row(account_id, start, end, account):
+    low_id = account.get("lowID")
+    return (account_id, account.get("name"), None if low_id is None else str(low_id), start, end,
+            *(metric_value(account, field) for field in INDEX_METRICS))
+
+class RankingQueries:
+    # leaderboard queries for IndexedRankings over an SQLite "accounts" table with
+    # one column per ranking metric and a ("field" DESC, id) index on each; needs
+    # self.db, self.lock, self.refresh(), and self._data_version(), which changes
+    # whenever rows are added or removed behind our back (see count()).
+    # Everything is answered from the indexes, nothing per account is kept in memory.
+    def ranking_slice(self, field, start, count):
+        self.refresh()
+        with self.lock:
+            return self.db.execute(f'SELECT id, name, "{field}" FROM accounts ORDER BY "{field}" DESC, id LIMIT ? OFFSET ?',
+                                   (count, start)).fetchall()
+
+    def ranking_position(self, field, account_id):
+        self.refresh()
+        with self.lock:
+            row = self.db.execute(f'SELECT "{field}" FROM accounts WHERE id = ?', (account_id,)).fetchone()
+            if row is None:
+                return None
+            # two range counts over the covering index instead of an OR the planner can't seek on
+            ahead = self.db.execute(f'SELECT (SELECT COUNT(*) FROM accounts WHERE "{field}" > ?) + '
+                                    f'(SELECT COUNT(*) FROM accounts WHERE "{field}" = ? AND id < ?)',
+                                    (row[0], row[0], account_id)).fetchone()[0]
+            return ahead + 1, row[0]
+
+    def count(self):
+        # cached per data version: the bot itself only ever updates existing rows
+        self.refresh()
+        with self.lock:
+            version = self._data_version()
+            if self.rank_count is None or self.rank_count[0] != version:
+                self.rank_count = (version, self.db.execute("SELECT COUNT(*) FROM accounts").fetchone()[0])
+            return self.rank_count[1]
+
+class StreamingAccountStore(RankingQueries, FileAccountStore):
+    INSERT_BATCH = 5000
+
+    def __init__(self, path=ACCOUNTS_PATH, index_path=ACCOUNTS_INDEX_PATH, flush_interval=2.0):
+        super().__init__(path, flush_interval)
+        self.index_path = index_path
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(index_path, check_same_thread=False)
+        columns = ", ".join(f'"{field}" INTEGER' for field in INDEX_METRICS)
+        self.db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS accounts (id TEXT PRIMARY KEY, name TEXT, lowid TEXT,
+                                                 start INTEGER, stop INTEGER, {columns});
+            CREATE TABLE IF NOT EXISTS blocks (n INTEGER PRIMARY KEY, crc INTEGER);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._create_indexes()
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        self.signature = tuple(json.loads(row[0])) if row and row[0] != "null" else None
+        self.rank_count = None   # (data version, number of accounts)
+        self.rank_epoch = 0      # bumped on every reindex
+
+    def _data_version(self):
+        return self.rank_epoch
+
+    def _create_indexes(self):
+        self.db.execute("CREATE INDEX IF NOT EXISTS accounts_name ON accounts (name, start)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS accounts_lowid ON accounts (lowid, start)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS accounts_start ON accounts (start)")
+        for field in INDEX_METRICS:
+            self.db.execute(f'CREATE INDEX IF NOT EXISTS "accounts_{field}" ON accounts ("{field}" DESC, id)')
+
+    def _drop_indexes(self):
+        for (name,) in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'accounts_%'").fetchall():
+            self.db.execute(f'DROP INDEX "{name}"')
+
+    def _open(self):
+        # the file together with the signature of exactly that file, so a
+        # concurrent replace can't pair one version's offsets with another's bytes
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return None, None
+        return f, stat_signature(os.fstat(f.fileno()))
+
+    def _load(self, signature):
+        f, signature = self._open()
+        with f or contextlib.nullcontext():
+            self._load_file(f, signature)
+
+    def _load_file(self, f, signature):
+        self.rank_epoch += 1
+        started = time.perf_counter()
+        try:
+            self._reindex(f, signature)
+        finally:
+            METRICS.observe("tgbot_file_load_seconds", time.perf_counter() - started, (("file", "accounts_index"),))
+        self.loaded = True
+        # nothing is held in memory to hand over, listeners only learn that a reload happened
+        for listener in self.listeners:
+            listener.accounts_reloaded(None)
+        for account_id in list(self.pending):
+            account = self._read(account_id, f)
+            if account is None:
+                del self.pending[account_id]
+            else:
+                self._index_fields(account_id, account)
+        self.db.commit()
+
+    def _reindex(self, f, signature):
+        if signature is not None and signature == self.signature:
+            return  # index left by a previous run is still current
+        db = self.db
+        checksums = block_checksums(f) if f is not None else []
+        old = [crc for (crc,) in db.execute("SELECT crc FROM blocks ORDER BY n")]
+        first_changed = next((n for n, (a, b) in enumerate(zip(old, checksums)) if a != b), min(len(old), len(checksums)))
+        resume = None
+        if self.signature is not None and first_changed > 0:
+            row = db.execute("SELECT stop FROM accounts WHERE stop <= ? ORDER BY stop DESC LIMIT 1",
+                             (first_changed * INDEX_BLOCK,)).fetchone()
+            resume = row[0] if row else None
+        if old == checksums and self.signature is not None:
+            pass  # touched but not changed
+        elif resume is None:
+            # a full rebuild is much faster without maintaining the indexes row by row
+            self._drop_indexes()
+            db.execute("DELETE FROM accounts")
+            self._scan(f, 0, False)
+            self._create_indexes()
+        else:
+            db.execute("DELETE FROM accounts WHERE start > ?", (resume,))
+            self._scan(f, resume, True)
+        db.execute("DELETE FROM blocks")
+        db.executemany("INSERT INTO blocks (n, crc) VALUES (?, ?)", enumerate(checksums))
+        db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('signature', ?)", (json.dumps(signature),))
+        db.commit()
+        self.signature = signature
+
+    def _scan(self, f, offset, resume):
+        placeholders = ", ".join("?" * (5 + len(INDEX_METRICS)))
+        insert = f"INSERT OR REPLACE INTO accounts VALUES ({placeholders})"
+        batch = []
+        try:
+            if f is not None:
+                for account_id, start, end, account in scan_account_records(f, offset, resume):
+                    batch.append(index_row(account_id, start, end, account))
+                    if len(batch) >= self.INSERT_BATCH:
+                        self.db.executemany(insert, batch)
+                        batch = []
+        except (OSError, ValueError) as e:
+            logging.error(f"Error indexing accounts: {e}")
+        if batch:
+            self.db.executemany(insert, batch)
+
+    def _index_fields(self, account_id, account):
+        low_id = account.get("lowID")
+        assignments = ", ".join(f'"{field}" = ?' for field in INDEX_METRICS)
+        self.db.execute(f"UPDATE accounts SET name = ?, lowid = ?, {assignments} WHERE id = ?",
+                        (account.get("name"), None if low_id is None else str(low_id),
+                         *(metric_value(account, field) for field in INDEX_METRICS), account_id))
+
+    def _read(self, account_id, f=None):
+        if f is None:
+            f, signature = self._open()
+            if f is None:
+                return None
+            with f:
+                if signature != self.signature:
+                    self._load_file(f, signature)   # replaced since we indexed it
+                return self._read(account_id, f)
+        row = self.db.execute("SELECT start, stop FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        if row is None:
+            return None
+        f.seek(row[0])
+        account = json.loads(f.read(row[1] - row[0]))
+        account.update(self.pending.get(account_id, {}))
+        return account
+
+    def items(self):
+        # one streaming pass over the file, with unsaved changes applied
+        self.refresh()
+        with self.lock:
+            pending = {account_id: dict(changes) for account_id, changes in self.pending.items()}
+        try:
+            with open(self.path, "rb") as f:
+                for account_id, _, _, account in scan_account_records(f):
+                    account.update(pending.get(account_id, {}))
+                    yield account_id, account
+        except FileNotFoundError:
+            return
+
+    def get(self, account_id):
+        self.refresh()
+        with self.lock:
+            try:
+                return self._read(account_id)
+            except (OSError, ValueError):
+                # replaced under us: reindex and try once more
+                self._load(file_signature(self.path))
+                return self._read(account_id)
+
+    def _find(self, column, value):
+        self.refresh()
+        with self.lock:
+            row = self.db.execute(f"SELECT id FROM accounts WHERE {column} = ? ORDER BY start LIMIT 1",
+                                  (value,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], self.get(row[0])
+
+    def find_by_name(self, name):
+        return self._find("name", name)
+
+    def find_by_lowid(self, low_id):
+        return self._find("lowid", str(low_id))
+
+    def _apply(self, account_id, changes):
+        account = self._read(account_id)
+        if account is None:
+            return None
+        account.update(changes)
+        self.pending.setdefault(account_id, {}).update(changes)
+        self._index_fields(account_id, account)
+        for listener in self.listeners:
+            listener.account_changed(account_id, account)
+        return account
+
+    def _write(self):
+        # copy the file, replacing only the changed records; a record that got
+        # shorter is padded with spaces so nothing after it moves
+        spans = self.db.execute(f"SELECT id, start, stop FROM accounts WHERE id IN ({', '.join('?' * len(self.pending))}) "
+                                "ORDER BY start", list(self.pending)).fetchall()
+        written = []   # (account_id, old start, old stop, new start, new stop)
+        shift = 0
+        src, signature = self._open()
+        if src is None or signature != self.signature:
+            if src is not None:
+                src.close()
+            return False   # replaced since we indexed it
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        try:
+            with src, os.fdopen(fd, "w+b") as dst:
+                position = 0
+                for account_id, start, stop in spans:
+                    copy_range(src, dst, position, start)
+                    src.seek(start)
+                    account = json.loads(src.read(stop - start))
+                    account.update(self.pending[account_id])
+                    record = json.dumps(account, separators=(",", ":")).encode("utf-8")
+                    record += b" " * max(0, (stop - start) - len(record))
+                    dst.write(record)
+                    written.append((account_id, start, stop, start + shift, start + shift + len(record)))
+                    shift += len(record) - (stop - start)
+                    position = stop
+                copy_range(src, dst, position)
+                dst.flush()
+                os.fsync(dst.fileno())
+                checksums = block_checksums(dst)
+        except BaseException:
+            remove_quietly(tmp_path)
+            raise
+        if not self._replace(tmp_path):
+            return False
+        # records only ever grow, so shifting from the end never moves a row into
+        # a range that is still to be processed
+        bounds = [start for _, start, _, _, _ in written[1:]] + [None]
+        for (account_id, start, stop, new_start, new_stop), next_start in reversed(list(zip(written, bounds))):
+            moved = new_stop - stop
+            if moved:
+                if next_start is None:
+                    self.db.execute("UPDATE accounts SET start = start + ?, stop = stop + ? WHERE start >= ?",
+                                    (moved, moved, stop))
+                else:
+                    self.db.execute("UPDATE accounts SET start = start + ?, stop = stop + ? WHERE start >= ? AND start < ?",
+                                    (moved, moved, stop, next_start))
+        self.db.executemany("UPDATE accounts SET start = ?, stop = ? WHERE id = ?",
+                            [(new_start, new_stop, account_id) for account_id, _, _, new_start, new_stop in written])
+        self.db.execute("DELETE FROM blocks")
+        self.db.executemany("INSERT INTO blocks (n, crc) VALUES (?, ?)", enumerate(checksums))
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('signature', ?)", (json.dumps(self.signature),))
+        self.db.commit()
+        return True
+
+    def discard_pending(self):
+        with self.lock:
+            discarded = list(self.pending)
+            super().discard_pending()
+            for account_id in discarded:
+                account = self._read(account_id)
+                if account is not None:
+                    self._index_fields(account_id, account)
+            self.db.commit()
+
+    def close(self):
+        super().close()
+        with self.lock:
+            self.db.close()
+
+class IndexedRankings:
+    # same interface as Rankings, answered by a RankingQueries store
+    PAGE_SIZE = Rankings.PAGE_SIZE
+
+    def __init__(self, store):
+        self.store = store
+
+    def page(self, field, page):
+        pages = max(1, -(-self.store.count() // self.PAGE_SIZE))
+        page = min(max(page, 1), pages)
+        start = (page - 1) * self.PAGE_SIZE
+        rows = [(start + idx, account_id, value) for idx, (account_id, _, value)
+                in enumerate(self.store.ranking_slice(field, start, self.PAGE_SIZE), 1)]
+        return rows, page, pages
+
+    def rank(self, field, account_id):
+        result = self.store.ranking_position(field, account_id)
+        if result is None:
+            return None
+        return result[0], result[1], self.store.count()
+
+# -------------------------
+# Storage Backends
+# "json" (default) keeps accounts.json / club.db as they are, using the memory
+# or streaming account store. "sqlite" keeps accounts and clubs as rows in one
+# WAL-mode database, so lookups, leaderboard pages and single-field updates
+# are indexed row operations. Use migrate_db.py to move the JSON files over.
+# Each backend exposes accounts, rankings and clubs with the same interface.
+# -------------------------
+CLUB_DB_FILES = ["Database/Club/club.db", "Database/Club/clubs.json", "Database/Club/chat.db", "Database/Club/chats.json"]
+DATABASE_DIRS = ["Database/Clubs", "Database/Player"]
+
+def create_sqlite_schema(db):
+    columns = ", ".join(f'"{field}" INTEGER' for field in INDEX_METRICS)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(f"CREATE TABLE IF NOT EXISTS accounts (id TEXT PRIMARY KEY, name TEXT, lowid TEXT, clubid TEXT, "
+               f"{columns}, data TEXT NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS clubs (id TEXT PRIMARY KEY, grp TEXT, data TEXT NOT NULL)")
+    db.execute("CREATE INDEX IF NOT EXISTS accounts_name ON accounts (name)")
+    db.execute("CREATE INDEX IF NOT EXISTS accounts_lowid ON accounts (lowid)")
+    db.execute("CREATE INDEX IF NOT EXISTS accounts_clubid ON accounts (clubid)")
+    for field in INDEX_METRICS:
+        db.execute(f'CREATE INDEX IF NOT EXISTS "accounts_{field}" ON accounts ("{field}" DESC, id)')
+    db.commit()
+
+def account_row(account_id, account):
+    low_id, club_id = account.get("lowID"), account.get("clubID")
+    return (account_id, account.get("name"), None if low_id is None else str(low_id),
+            None if club_id is None else str(club_id),
+            *(metric_value(account, field) for field in INDEX_METRICS), json.dumps(account))
+
+def account_row_sql():
+    columns = ", ".join(f'"{field}"' for field in INDEX_METRICS)
+    placeholders = ", ".join("?" * (5 + len(INDEX_METRICS)))
+    return f"INSERT OR REPLACE INTO accounts (id, name, lowid, clubid, {columns}, data) VALUES ({placeholders})"
+
+def account_update_sql():
+    # in place, so the rowid (first-match order, items() paging) survives; takes account_row()[1:] + (id,)
+    assignments = ", ".join(f'"{field}" = ?' for field in INDEX_METRICS)
+    return f"UPDATE accounts SET name = ?, lowid = ?, clubid = ?, {assignments}, data = ? WHERE id = ?"
+
+class JSONStorage:
+    name = "json"
+
+    def __init__(self, server_config):
+        if server_config.get("accounts_mode", "memory") == "streaming":
+            self.accounts = StreamingAccountStore(
+                index_path=server_config.get("accounts_index_path", ACCOUNTS_INDEX_PATH),
+                flush_interval=server_config.get("accounts_flush_interval", 2.0))
+            self.rankings = IndexedRankings(self.accounts)
+        else:
+            self.accounts = AccountStore(flush_interval=server_config.get("accounts_flush_interval", 2.0))
+            self.rankings = Rankings(self.accounts)
+        self.clubs = ClubIndex()
+
+    def reset_accounts(self):
+        # True if there was anything to delete
+        self.accounts.discard_pending()
+        with self.accounts.file_lock:
+            if not os.path.exists(self.accounts.path):
+                return False
+            os.remove(self.accounts.path)
+        return True
+
+    def reset_clubs(self):
+        errors = []
+        for file_path in CLUB_DB_FILES:
+            try:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            except Exception as e:
+                errors.append(f"Error deleting {file_path}: {e}")
+        return errors
+
+    def reset_all(self):
+        errors = []
+        self.accounts.discard_pending()
+        for dir_path in DATABASE_DIRS:
+            try:
+                if os.path.exists(dir_path):
+                    shutil.rmtree(dir_path)
+            except Exception as e:
+                errors.append(f"Error deleting {dir_path}: {e}")
+        return errors
+
+    def close(self):
+        self.accounts.close()
+
+class SQLiteAccountStore(RankingQueries):
+    # writes go straight to the database, so nothing is ever pending
+    PAGE = 1000
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.db = storage.db
+        self.lock = storage.lock
+        self.listeners = []
+        self.pending = {}
+        self.rank_count = None   # (data version, number of accounts)
+
+    def _data_version(self):
+        return self.storage.generation
+
+    def refresh(self):
+        self.storage.refresh()
+
+    def get(self, account_id):
+        self.refresh()
+        with self.lock:
+            row = self.db.execute("SELECT data FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _find(self, column, value):
+        self.refresh()
+        with self.lock:
+            # first match wins, same as the JSON stores
+            row = self.db.execute(f"SELECT id, data FROM accounts WHERE {column} = ? ORDER BY rowid LIMIT 1",
+                                  (value,)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1])
+
+    def find_by_name(self, name):
+        return self._find("name", name)
+
+    def find_by_lowid(self, low_id):
+        return self._find("lowid", str(low_id))
+
+    def items(self):
+        self.refresh()
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.db.execute("SELECT rowid, id, data FROM accounts WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                       (last, self.PAGE)).fetchall()
+            if not rows:
+                return
+            for rowid, account_id, data in rows:
+                yield account_id, json.loads(data)
+            last = rows[-1][0]
+
+    def _apply(self, account_id, changes):
+        # call inside _write(): the read and the write must be one transaction
+        row = self.db.execute("SELECT data FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        if row is None:
+            return None
+        account = json.loads(row[0])
+        account.update(changes)
+        values = account_row(account_id, account)
+        self.db.execute(account_update_sql(), values[1:] + (account_id,))
+        return account
+
+    @contextlib.contextmanager
+    def _write(self):
+        # BEGIN IMMEDIATE takes the write lock before the SELECT, so the game
+        # server can't commit between our read and our write of the same row
+        with self.lock:
+            if self.db.in_transaction:
+                self.db.commit()
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.db.commit()
+
+    def update(self, account_id, changes):
+        self.refresh()
+        with self._write():
+            account = self._apply(account_id, changes)
+        if account is not None:
+            for listener in self.listeners:
+                listener.account_changed(account_id, account)
+        return account
+
+    def update_many(self, changes_by_account):
+        # one transaction for the whole batch; returns how many accounts changed
+        self.refresh()
+        updated = []
+        with self._write():
+            for account_id, changes in changes_by_account.items():
+                account = self._apply(account_id, changes)
+                if account is not None:
+                    updated.append((account_id, account))
+        for account_id, account in updated:
+            for listener in self.listeners:
+                listener.account_changed(account_id, account)
+        return len(updated)
+
+    def flush(self):
+        pass
+
+    def discard_pending(self):
+        pass
+
+    def close(self):
+        pass
+
+class SQLiteClubIndex:
+    def __init__(self, storage):
+        self.storage = storage
+
+    @property
+    def signature(self):
+        return self.storage.generation
+
+    def refresh(self):
+        self.storage.refresh()
+
+    def get(self, club_id):
+        self.refresh()
+        with self.storage.lock:
+            row = self.storage.db.execute("SELECT data FROM clubs WHERE id = ?", (str(club_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+class SQLiteStorage:
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        create_sqlite_schema(self.db)
+        self.data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        self.generation = 0   # bumped when another process commits (e.g. the game server)
+        self.accounts = SQLiteAccountStore(self)
+        self.rankings = IndexedRankings(self.accounts)
+        self.clubs = SQLiteClubIndex(self)
+
+    def refresh(self):
+        with self.lock:
+            data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self.data_version:
+                return
+            self.data_version = data_version
+            self.generation += 1
+        for listener in self.accounts.listeners:
+            listener.accounts_reloaded(None)
+
+    def reset_accounts(self):
+        with self.lock:
+            deleted = self.db.execute("DELETE FROM accounts").rowcount
+            self.db.commit()
+        self._changed()
+        return deleted > 0
+
+    def reset_clubs(self):
+        with self.lock:
+            self.db.execute("DELETE FROM clubs")
+            self.db.commit()
+        self._changed()
+        return []
+
+    def reset_all(self):
+        with self.lock:
+            self.db.execute("DELETE FROM accounts")
+            self.db.execute("DELETE FROM clubs")
+            self.db.commit()
+        self._changed()
+        return []
+
+    def _changed(self):
+        with self.lock:
+            self.generation += 1
+        for listener in self.accounts.listeners:
+            listener.accounts_reloaded(None)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def open_storage(server_config):
+    if server_config.get("storage", "json") == "sqlite":
+        return SQLiteStorage(server_config.get("sqlite_path", SQLITE_DB_PATH))
+    return JSONStorage(server_config)
+
+# -------------------------
+# Response Cache
+# Rendered /profile, /leaderboard and /info texts, each stored with the data
+# version it was built from, plus the Telegram file_ids of the /info images.
+# Registered as an account store listener so changes bump the versions.
+# -------------------------
+class ResponseCache:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # key -> (version, text), least recently used first
+        self.epoch = 0                 # bumped whenever the whole account file is reloaded
+        self.versions = {}             # account_id -> change counter within the epoch
+        self.ranking_version = 0       # bumped on any account change
+        self.file_ids = {}             # image url -> Telegram file_id
+
+    def account_changed(self, account_id, account):
+        with self.lock:
+            self.versions[account_id] = self.versions.get(account_id, 0) + 1
+            self.ranking_version += 1
+
+    def accounts_reloaded(self, accounts):
+        with self.lock:
+            self.epoch += 1
+            self.versions.clear()
+            self.ranking_version += 1
+
+    def account_version(self, account_id):
+        return (self.epoch, self.versions.get(account_id, 0))
+
+    def rankings_version(self):
+        return (self.epoch, self.ranking_version)
+
+    def render(self, key, version, render):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                METRICS.inc("tgbot_response_cache_hits_total", (("kind", key[0]),))
+                return entry[1]
+        METRICS.inc("tgbot_response_cache_misses_total", (("kind", key[0]),))
+        text = render()
+        with self.lock:
+            self.entries[key] = (version, text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return text
+
+    def media(self, url):
+        # the file_id Telegram gave us for this url, or the url itself
+        return self.file_ids.get(url, url)
+
+    def remember_media(self, urls, messages):
+        for url, sent in zip(urls, messages):
+            photo = getattr(sent, "photo", None)
+            if photo:
+                self.file_ids[url] = photo[-1].file_id
+
+    def forget_media(self, urls):
+        for url in urls:
+            self.file_ids.pop(url, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+# -------------------------
+# System Stats Sampler
+# Samples CPU/RAM/disk/network/RSS in the background into a ring buffer so
+# /status never blocks a handler thread.
+# -------------------------
+class StatsSampler:
+    def __init__(self, interval=5, history_minutes=60):
+        self.interval = interval
+        self.samples = deque(maxlen=max(1, int(history_minutes * 60 / interval)))
+        self.process = psutil.Process()
+        self.last_net = None
+        self.stop_event = threading.Event()
+        psutil.cpu_percent(interval=None)  # primes the non-blocking cpu counter
+        self.sample()
+        self.thread = threading.Thread(target=self._loop, name="stats-sampler", daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error(f"Error sampling system stats: {e}")
+
+    def sample(self):
+        now = time.time()
+        net = psutil.net_io_counters()
+        if self.last_net is None:
+            net_sent = net_recv = 0.0
+        else:
+            elapsed = max(now - self.last_net[0], 1e-6)
+            net_sent = (net.bytes_sent - self.last_net[1]) / elapsed
+            net_recv = (net.bytes_recv - self.last_net[2]) / elapsed
+        self.last_net = (now, net.bytes_sent, net.bytes_recv)
+        self.samples.append({
+            "time": now,
+            "cpu": psutil.cpu_percent(interval=None),
+            "ram": psutil.virtual_memory().percent,
+            "disk": psutil.disk_usage('/').percent,
+            "net_sent": net_sent,
+            "net_recv": net_recv,
+            "rss": self.process.memory_info().rss,
+        })
+
+    def latest(self):
+        return self.samples[-1]
+
+    def summary(self, minutes):
+        # {field: (min, avg, max)} over the last `minutes`, plus the sample count
+        cutoff = time.time() - minutes * 60
+        window = [sample for sample in list(self.samples) if sample["time"] >= cutoff]
+        if not window:
+            return {}, 0
+        fields = ("cpu", "ram", "disk", "net_sent", "net_recv", "rss")
+        return {field: (min(s[field] for s in window), sum(s[field] for s in window) / len(window),
+                        max(s[field] for s in window)) for field in fields}, len(window)
+
+    def close(self):
+        self.stop_event.set()
+
+# -------------------------
+# Rate Limited Sending
+# Telegram allows ~30 messages/s per bot and about 1/s per chat (20/min in groups).
+# -------------------------
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class RateLimitedSender:
+    PRIVATE_INTERVAL = 1.0
+    GROUP_INTERVAL = 3.0
+
+    def __init__(self, bot, rate=25, max_retries=3):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.chat_next = {}   # chat_id -> earliest monotonic time for the next send
+
+    def _wait_for_chat(self, chat_id):
+        interval = self.GROUP_INTERVAL if str(chat_id).startswith("-") else self.PRIVATE_INTERVAL
+        with self.lock:
+            now = time.monotonic()
+            if len(self.chat_next) > 10000:
+                self.chat_next = {k: v for k, v in self.chat_next.items() if v > now}
+            slot = max(now, self.chat_next.get(chat_id, 0.0))
+            self.chat_next[chat_id] = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def send(self, chat_id, text, **kwargs):
+        # returns "sent", "blocked" (bot blocked / chat gone) or "failed"
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_chat(chat_id)
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(chat_id, text, **kwargs)
+                return "sent"
+            except telebot.apihelper.ApiTelegramException as e:
+                if e.error_code == 429:
+                    retry_after = (e.result_json or {}).get("parameters", {}).get("retry_after", 2 ** attempt)
+                    self.bucket.pause(retry_after)
+                    time.sleep(retry_after)
+                    continue
+                if e.error_code in (400, 403):
+                    logging.error(f"Failed to send to {chat_id}: {e}")
+                    return "blocked"
+                error = e
+            except Exception as e:
+                error = e
+            logging.error(f"Failed to send to {chat_id} (attempt {attempt + 1}): {error}")
+            time.sleep(min(2 ** attempt, 30))
+        return "failed"
+
+# -------------------------
+# News Broadcasts
+# Runs in the background on a bounded pool so handlers keep serving.
+# -------------------------
+class Broadcaster:
+    PROGRESS_INTERVAL = 15
+
+    def __init__(self, bot, workers=8, rate=25):
+        self.bot = bot
+        self.sender = RateLimitedSender(bot, rate=rate)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="broadcast")
+        self.threads = []
+
+    def start(self, chat_ids, text, report_chat_id):
+        thread = threading.Thread(target=self._run, args=(list(chat_ids), text, report_chat_id),
+                                  name="broadcast-coordinator", daemon=True)
+        self.threads = [t for t in self.threads if t.is_alive()] + [thread]
+        thread.start()
+        return thread
+
+    def join(self, timeout=None):
+        for thread in list(self.threads):
+            thread.join(timeout)
+
+    def _run(self, chat_ids, text, report_chat_id):
+        started = time.monotonic()
+        counts = {"sent": 0, "blocked": 0, "failed": 0}
+        last_report = started
+        try:
+            futures = [self.pool.submit(self.sender.send, chat_id, text) for chat_id in chat_ids]
+        except RuntimeError:
+            logging.error("Broadcast cancelled: bot is shutting down")
+            return
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                logging.error(f"Broadcast worker error: {e}")
+                counts["failed"] += 1
+            now = time.monotonic()
+            if now - last_report >= self.PROGRESS_INTERVAL and done < len(futures):
+                last_report = now
+                self._report(report_chat_id, f"📰 Broadcast progress: {done}/{len(futures)} chats processed.")
+        elapsed = time.monotonic() - started
+        self._report(report_chat_id, (
+            "News has been sent to all known chats!\n"
+            f"Sent: {counts['sent']}\n"
+            f"Blocked/Invalid: {counts['blocked']}\n"
+            f"Failed: {counts['failed']}\n"
+            f"Time: {elapsed:.1f}s"
+        ))
+
+    def _report(self, chat_id, text):
+        try:
+            self.bot.send_message(chat_id, text)
+        except Exception as e:
+            logging.error(f"Failed to report broadcast progress to {chat_id}: {e}")
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+# -------------------------
+# Journal
+# Append-only JSON-lines log. Appends are queued in memory and written by a
+# background thread; the owner can compact the log into a fresh snapshot.
+# -------------------------
+class Journal:
+    def __init__(self, path, flush_interval=2.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()        # guards the queue
+        self.write_lock = threading.Lock()  # serialises file writes
+        self.queue = []
+        self.line_count = 0
+        self.compactor = None   # callable returning the records of a full snapshot
+        self.compact_threshold = 10000
+        self.encoder = json.JSONEncoder(separators=(",", ":"))
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def replay(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = [line for line in f.read().split("\n") if line]
+        except FileNotFoundError:
+            return []
+        self.line_count = len(lines)
+        try:
+            # one C-level parse instead of a json.loads per line
+            return json.loads("[" + ",".join(lines) + "]")
+        except json.JSONDecodeError:
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.error(f"Skipping corrupt line in {self.path}")
+            return records
+
+    def append(self, record):
+        with self.lock:
+            self.queue.append(record)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name=f"journal:{self.path}", daemon=True)
+            self.thread.start()
+
+    def _loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                queue, self.queue = self.queue, []
+                # the compactor only copies state here; encoding happens outside the lock
+                records = None
+                if self.compactor is not None and self.line_count + len(queue) > self.compact_threshold:
+                    records = self.compactor()
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                if records is not None:
+                    self._compact(records)
+                elif queue:
+                    encode = self.encoder.encode
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write("".join(encode(record) + "\n" for record in queue))
+                    self.line_count += len(queue)
+            except Exception as e:
+                logging.error(f"Error writing {self.path}: {e}")
+                if records is None:
+                    with self.lock:
+                        self.queue[:0] = queue
+
+    def _compact(self, records):
+        encode = self.encoder.encode
+        lines = [encode(record) + "\n" for record in records]
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.line_count = len(lines)
+        # compact again once the log has doubled
+        self.compact_threshold = max(10000, self.line_count * 2)
+
+    def close(self):
+        self.stop_event.set()
+        self.flush()
+
+# -------------------------
+# User Registry
+# Known chats, usernames and support moderation state, kept as plain in-memory
+# sets/dicts whose changes are journaled to disk in the background.
+# -------------------------
+class JournaledSet(set):
+    def __init__(self, journal, add_op, remove_op):
+        super().__init__()
+        self.journal = journal
+        self.add_op = add_op
+        self.remove_op = remove_op
+
+    def add(self, item):
+        if item not in self:
+            super().add(item)
+            self.journal.append([self.add_op, item])
+
+    def update(self, *iterables):
+        for iterable in iterables:
+            for item in iterable:
+                self.add(item)
+
+    def remove(self, item):
+        super().remove(item)
+        self.journal.append([self.remove_op, item])
+
+    def discard(self, item):
+        if item in self:
+            self.remove(item)
+
+class JournaledDict(dict):
+    _missing = object()
+
+    def __init__(self, journal, set_op, delete_op):
+        super().__init__()
+        self.journal = journal
+        self.set_op = set_op
+        self.delete_op = delete_op
+
+    def __setitem__(self, key, value):
+        if self.get(key, self._missing) != value:
+            super().__setitem__(key, value)
+            self.journal.append([self.set_op, key, value])
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.journal.append([self.delete_op, key])
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return super().pop(key, *default)
+
+def normalize_handle(name):
+    return str(name).strip().lstrip("@").lower()
+
+class UsernameMap(JournaledDict):
+    # also keeps normalized handle -> {chat_id, ...} so moderation lookups are O(1);
+    # first names (and a first name equal to someone's @username) can be shared
+    def __init__(self, journal, set_op, delete_op):
+        super().__init__(journal, set_op, delete_op)
+        self.by_handle = {}
+
+    def _index(self, chat_id, name):
+        self.by_handle.setdefault(normalize_handle(name), set()).add(chat_id)
+
+    def _unindex(self, chat_id):
+        old = self.get(chat_id)
+        if old is None:
+            return
+        chat_ids = self.by_handle.get(normalize_handle(old))
+        if chat_ids is not None:
+            chat_ids.discard(chat_id)
+            if not chat_ids:
+                del self.by_handle[normalize_handle(old)]
+
+    def __setitem__(self, key, value):
+        if self.get(key, self._missing) != value:
+            self._unindex(key)
+            self._index(key, value)
+            super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._unindex(key)
+        super().__delitem__(key)
+
+    def restore(self, chat_id, name):
+        # replay from the journal without journaling again
+        self._unindex(chat_id)
+        self._index(chat_id, name)
+        dict.__setitem__(self, chat_id, name)
+
+    def forget(self, chat_id):
+        self._unindex(chat_id)
+        dict.pop(self, chat_id, None)
+
+    def find(self, handle):
+        # every chat id known under this handle, possibly more than one
+        return sorted(self.by_handle.get(normalize_handle(handle), ()))
+
+class UserRegistry:
+    def __init__(self, path=USERS_LOG_PATH, flush_interval=2.0):
+        self.journal = Journal(path, flush_interval)
+        self.all_users = JournaledSet(self.journal, "u", "du")
+        self.usernames = UsernameMap(self.journal, "n", "dn")
+        self.banned_users = JournaledSet(self.journal, "b", "ub")
+        self.muted_users = JournaledDict(self.journal, "m", "um")
+        self.ban_expiry = JournaledDict(self.journal, "bt", "ubt")   # chat_id -> unban timestamp
+        self.load()
+        self.journal.compactor = self.snapshot
+        self.journal.start()
+
+    def load(self):
+        handlers = {
+            "u": lambda chat_id: set.add(self.all_users, chat_id),
+            "du": lambda chat_id: set.discard(self.all_users, chat_id),
+            "n": self.usernames.restore,
+            "dn": self.usernames.forget,
+            "b": lambda chat_id: set.add(self.banned_users, chat_id),
+            "ub": lambda chat_id: set.discard(self.banned_users, chat_id),
+            "m": lambda chat_id, until: dict.__setitem__(self.muted_users, chat_id, until),
+            "um": lambda chat_id: dict.pop(self.muted_users, chat_id, None),
+            "bt": lambda chat_id, until: dict.__setitem__(self.ban_expiry, chat_id, until),
+            "ubt": lambda chat_id: dict.pop(self.ban_expiry, chat_id, None),
+        }
+        for record in self.journal.replay():
+            try:
+                handlers[record[0]](*record[1:])
+            except (KeyError, TypeError, IndexError):
+                logging.error(f"Skipping unknown user registry record: {record}")
+
+    def snapshot(self):
+        # copy now (called under the journal lock), turn into records later
+        all_users = list(self.all_users)
+        usernames = list(self.usernames.items())
+        banned_users = list(self.banned_users)
+        muted_users = list(self.muted_users.items())
+        ban_expiry = list(self.ban_expiry.items())
+
+        def records():
+            for chat_id in all_users:
+                yield ["u", chat_id]
+            for chat_id, name in usernames:
+                yield ["n", chat_id, name]
+            for chat_id in banned_users:
+                yield ["b", chat_id]
+            for chat_id, until in muted_users:
+                yield ["m", chat_id, until]
+            for chat_id, until in ban_expiry:
+                yield ["bt", chat_id, until]
+        return records()
+
+    def close(self):
+        self.journal.close()
+
+# -------------------------
+# Moderation Scheduler
+# Mutes and timed bans expire from a min-heap of deadlines: a background
+# thread sleeps until the earliest one, drops the entry from the registry and
+# tells the user through the rate-limited sender. Re-muting just pushes a new
+# deadline; entries that no longer match the registry are skipped when popped.
+# -------------------------
+DURATION_RE = re.compile(r"^(\d+)([smhdw]?)$", re.IGNORECASE)
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+DURATION_NAMES = (("week", 604800), ("day", 86400), ("hour", 3600), ("minute", 60), ("second", 1))
+
+def parse_duration(text, default_unit="m"):
+    # "30" (minutes), "45s", "2h", "1d", "1w" -> seconds, or None
+    match = DURATION_RE.match(text.strip())
+    if not match:
+        return None
+    return int(match.group(1)) * DURATION_UNITS[(match.group(2) or default_unit).lower()]
+
+def format_duration(seconds):
+    for name, size in DURATION_NAMES:
+        if seconds >= size and seconds % size == 0:
+            count = seconds // size
+            return f"{count} {name}{'s' if count != 1 else ''}"
+    return f"{seconds} seconds"
+
+class ModerationScheduler:
+    def __init__(self, users, sender):
+        self.users = users
+        self.sender = sender
+        self.cond = threading.Condition()
+        self.heap = []   # (deadline, kind, chat_id)
+        self.stop_event = threading.Event()
+        with self.cond:
+            self._rebuild()
+        self.thread = threading.Thread(target=self._loop, name="moderation", daemon=True)
+        self.thread.start()
+
+    def _rebuild(self):
+        self.heap = [(until, "mute", chat_id) for chat_id, until in self.users.muted_users.items()]
+        self.heap += [(until, "ban", chat_id) for chat_id, until in self.users.ban_expiry.items()]
+        heapq.heapify(self.heap)
+
+    def _schedule(self, deadline, kind, chat_id):
+        with self.cond:
+            heapq.heappush(self.heap, (deadline, kind, chat_id))
+            # superseded deadlines pile up when the same users are punished again and again
+            if len(self.heap) > 64 + 2 * (len(self.users.muted_users) + len(self.users.ban_expiry)):
+                self._rebuild()
+            if self.heap[0][0] == deadline:
+                self.cond.notify()
+
+    def mute(self, chat_id, seconds):
+        until = time.time() + seconds
+        with self.cond:
+            self.users.muted_users[chat_id] = until
+            self._schedule(until, "mute", chat_id)
+
+    def unmute(self, chat_id):
+        with self.cond:
+            return self.users.muted_users.pop(chat_id, None) is not None
+
+    def ban(self, chat_id, seconds=None):
+        # no duration means a permanent ban, which also cancels a pending expiry
+        with self.cond:
+            self.users.banned_users.add(chat_id)
+            if seconds is None:
+                self.users.ban_expiry.pop(chat_id, None)
+                return
+            until = time.time() + seconds
+            self.users.ban_expiry[chat_id] = until
+            self._schedule(until, "ban", chat_id)
+
+    def unban(self, chat_id):
+        with self.cond:
+            if chat_id not in self.users.banned_users:
+                return False
+            self.users.banned_users.discard(chat_id)
+            self.users.ban_expiry.pop(chat_id, None)
+            return True
+
+    def is_muted(self, chat_id):
+        until = self.users.muted_users.get(chat_id)
+        return until is not None and time.time() < until
+
+    def is_banned(self, chat_id):
+        if chat_id not in self.users.banned_users:
+            return False
+        until = self.users.ban_expiry.get(chat_id)
+        return until is None or time.time() < until
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            expired = []
+            with self.cond:
+                now = time.time()
+                while self.heap and self.heap[0][0] <= now:
+                    deadline, kind, chat_id = heapq.heappop(self.heap)
+                    if self._expire(deadline, kind, chat_id):
+                        expired.append((kind, chat_id))
+                if not expired:
+                    self.cond.wait(self.heap[0][0] - now if self.heap else None)
+                    continue
+            for kind, chat_id in expired:
+                text = ("Your mute has ended. You can use /support again." if kind == "mute"
+                        else "Your support ban has expired. You can use /support again.")
+                try:
+                    self.sender.send(chat_id, text)
+                except Exception as e:
+                    logging.error(f"Error sending {kind} expiry notice to {chat_id}: {e}")
+
+    def _expire(self, deadline, kind, chat_id):
+        # False for a deadline that was replaced or cancelled in the meantime
+        if kind == "mute":
+            if self.users.muted_users.get(chat_id) != deadline:
+                return False
+            self.users.muted_users.pop(chat_id, None)
+            return True
+        if self.users.ban_expiry.get(chat_id) != deadline:
+            return False
+        self.users.ban_expiry.pop(chat_id, None)
+        self.users.banned_users.discard(chat_id)
+        return True
+
+    def __len__(self):
+        return len(self.users.muted_users) + len(self.users.ban_expiry)
+
+    def close(self):
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify()
+
+# -------------------------
+# Forwarded Messages
+# support group message_id -> user chat_id for routing replies, kept in memory
+# (oldest first) and journaled; old or excess mappings are evicted.
+# -------------------------
+class ForwardedMessageStore:
+    def __init__(self, path=FORWARDED_LOG_PATH, max_entries=50000, max_age_days=30,
+                 flush_interval=2.0, legacy_path=FORWARDED_LEGACY_PATH):
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.messages = OrderedDict()   # message_id -> (user_chat_id, saved_at)
+        self.journal = Journal(path, flush_interval)
+        for record in self.journal.replay():
+            if len(record) == 4 and record[0] == "f":
+                self.messages[record[1]] = (record[2], record[3])
+                self.messages.move_to_end(record[1])
+        if not self.messages and legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+        self._evict()
+        self.journal.compactor = self.snapshot
+        self.journal.start()
+
+    def _import_legacy(self, legacy_path):
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Error importing {legacy_path}: {e}")
+            return
+        now = time.time()
+        for message_id, user_chat_id in data.items():
+            if str(message_id).lstrip("-").isdigit():
+                self.messages[int(message_id)] = (user_chat_id, now)
+        # force the first flush to write a full snapshot
+        self.journal.compact_threshold = -1
+
+    def _evict(self):
+        cutoff = time.time() - self.max_age
+        while self.messages:
+            message_id, (_, saved_at) = next(iter(self.messages.items()))
+            if len(self.messages) <= self.max_entries and saved_at >= cutoff:
+                break
+            self.messages.popitem(last=False)
+
+    def save(self, message_id, user_chat_id):
+        now = time.time()
+        with self.lock:
+            self.messages[message_id] = (user_chat_id, now)
+            self.messages.move_to_end(message_id)
+            self._evict()
+        # outside self.lock: a journal flush holds the journal lock while
+        # snapshot() takes self.lock. A compaction in between only repeats the record.
+        self.journal.append(["f", message_id, user_chat_id, now])
+
+    def get(self, message_id):
+        entry = self.messages.get(message_id)
+        return entry[0] if entry else None
+
+    def snapshot(self):
+        with self.lock:
+            items = list(self.messages.items())
+        return (["f", message_id, user_chat_id, saved_at] for message_id, (user_chat_id, saved_at) in items)
+
+    def close(self):
+        self.journal.close()
+
+# -------------------------
+# Support Inbox
+# Support messages and admin requests are queued and posted to the support group
+# as numbered digests instead of one message each. Repeats from the same user
+# fold into their pending ticket, urgent tickets skip the queue. Every ticket in
+# a digest gets its own forwarded mapping ("<message_id>#<n>"), so admins answer
+# one by replying to the digest with "#<n> <text>".
 # -------------------------
-# Helper Functions
+TICKET_REF_RE = re.compile(r"^#(\d+)\s*(.*)$", re.DOTALL)
+TICKET_KINDS = {
+    "support": ("Support message", "Message Content"),
+    "admin_request": ("Admin request", "Request Content"),
+}
+DEFAULT_URGENT_KEYWORDS = ("urgent", "hacked", "stolen", "scam")
+
+class SupportTicket:
+    def __init__(self, kind, chat_id, sender, text, received_at):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.sender = sender
+        self.texts = [text]
+        self.count = 1
+        self.first_at = received_at
+        self.last_at = received_at
+
+    def merge(self, sender, text, received_at):
+        self.sender = sender
+        self.count += 1
+        self.last_at = received_at
+        normalized = " ".join(text.lower().split())
+        if all(" ".join(t.lower().split()) != normalized for t in self.texts) and len(self.texts) < SupportInbox.MAX_TEXTS:
+            self.texts.append(text)
+
+class SupportInbox:
+    MAX_TEXTS = 5           # distinct messages kept per ticket, later ones are only counted
+    MAX_TEXT_LENGTH = 500   # per message inside a digest
+    DIGEST_LIMIT = 4000     # Telegram caps a message at 4096 characters
+    SEND_ATTEMPTS = 3
+    POLL = 30               # re-read the interval at least this often (hot reload)
+    RETRY_BASE = 5          # seconds before the first retry of a failed digest, doubling
+    RETRY_MAX = 600
+
+    def __init__(self, bot, forwarded, settings):
+        self.bot = bot
+        self.forwarded = forwarded
+        self.settings = settings   # callable returning the current server config
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()   # (kind, chat_id) -> SupportTicket, oldest first
+        self.failures = 0              # digest posts failed in a row
+        self.retry_at = 0.0            # no digest before this time while backing off
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._loop, name="support-inbox", daemon=True)
+        self.thread.start()
+
+    @property
+    def target(self):
+        return self.settings().get("support_group_id")
+
+    @property
+    def interval(self):
+        return self.settings().get("support_digest_interval", 60)
+
+    @property
+    def max_batch(self):
+        return max(1, self.settings().get("support_digest_max", 20))
+
+    def is_urgent(self, text):
+        keywords = self.settings().get("support_urgent_keywords", DEFAULT_URGENT_KEYWORDS)
+        lowered = (text or "").lower()
+        return any(keyword.lower() in lowered for keyword in keywords)
+
+    def submit(self, kind, chat_id, sender, text):
+        # False if there is no support group to deliver to
+        target = self.target
+        if not target:
+            return False
+        text = text or ""
+        now = time.time()
+        if self.interval <= 0 or self.is_urgent(text):
+            METRICS.inc("tgbot_support_tickets_total", (("route", "immediate"),))
+            ticket = SupportTicket(kind, chat_id, sender, text, now)
+            forwarded_message = self._send(target, self.format_single(ticket))
+            self.forwarded.save(forwarded_message.message_id, chat_id)
+            return True
+        with self.cond:
+            ticket = self.pending.get((kind, chat_id))
+            if ticket is None:
+                METRICS.inc("tgbot_support_tickets_total", (("route", "queued"),))
+                self.pending[(kind, chat_id)] = SupportTicket(kind, chat_id, sender, text, now)
+            else:
+                METRICS.inc("tgbot_support_tickets_total", (("route", "merged"),))
+                ticket.merge(sender, text, now)
+            self.cond.notify()
+        return True
+
+    def format_single(self, ticket):
+        # the same text the bot always forwarded for a single message
+        title, label = TICKET_KINDS[ticket.kind]
+        timestamp = datetime.fromtimestamp(ticket.first_at).strftime("%Y-%m-%d %H:%M:%S")
+        return f"{title} received at: {timestamp}\nSender: {ticket.sender}\n{label}: \"{ticket.texts[0]}\""
+
+    def format_ticket(self, number, ticket):
+        title, _ = TICKET_KINDS[ticket.kind]
+        first = datetime.fromtimestamp(ticket.first_at).strftime("%H:%M:%S")
+        line = f"#{number} {title} from {ticket.sender} at {first}"
+        if ticket.count > 1:
+            line += f" ({ticket.count}x, last {datetime.fromtimestamp(ticket.last_at).strftime('%H:%M:%S')})"
+        texts = [text if len(text) <= self.MAX_TEXT_LENGTH else text[:self.MAX_TEXT_LENGTH] + "…" for text in ticket.texts]
+        return line + "\n" + "\n".join(f"\"{text}\"" for text in texts)
+
+    def _digests(self, tickets):
+        # split into messages that fit Telegram's limit, numbering from 1 in each
+        header = "📥 Support digest - reply with #<number> and your answer (or accept/decline/mute/ban/unban)\n"
+        chunk, text = [], header
+        for ticket in tickets:
+            entry = "\n" + self.format_ticket(len(chunk) + 1, ticket) + "\n"
+            if chunk and len(text) + len(entry) > self.DIGEST_LIMIT:
+                yield chunk, text
+                chunk, text = [], header
+                entry = "\n" + self.format_ticket(1, ticket) + "\n"
+            chunk.append(ticket)
+            text += entry
+        if chunk:
+            yield chunk, text
+
+    def _send(self, chat_id, text):
+        for attempt in range(self.SEND_ATTEMPTS):
+            try:
+                return self.bot.send_message(chat_id, text)
+            except telebot.apihelper.ApiTelegramException as e:
+                if e.error_code != 429 or attempt == self.SEND_ATTEMPTS - 1:
+                    raise
+                time.sleep((e.result_json or {}).get("parameters", {}).get("retry_after", 2 ** attempt))
+
+    def _due(self):
+        if not self.pending:
+            return None
+        if len(self.pending) >= self.max_batch:
+            return self.retry_at
+        return max(next(iter(self.pending.values())).first_at + self.interval, self.retry_at)
+
+    def _take(self):
+        batch = []
+        while self.pending and len(batch) < self.max_batch:
+            batch.append(self.pending.popitem(last=False)[1])
+        return batch
+
+    def _requeue(self, tickets):
+        # back to the front of the queue, folding in anything that arrived meanwhile
+        with self.cond:
+            for ticket in reversed(tickets):
+                newer = self.pending.pop((ticket.kind, ticket.chat_id), None)
+                if newer is not None:
+                    for text in newer.texts:
+                        ticket.merge(newer.sender, text, newer.last_at)
+                    ticket.count += newer.count - len(newer.texts)
+                self.pending[(ticket.kind, ticket.chat_id)] = ticket
+                self.pending.move_to_end((ticket.kind, ticket.chat_id), last=False)
+
+    def _backoff(self, failed):
+        # returns the delay before the next digest
+        if not failed:
+            self.failures = 0
+            self.retry_at = 0.0
+            return 0.0
+        self.failures += 1
+        delay = min(self.RETRY_MAX, self.RETRY_BASE * 2 ** (self.failures - 1))
+        self.retry_at = time.time() + delay
+        return delay
+
+    def _post(self, tickets):
+        target = self.target
+        digests = list(self._digests(tickets))
+        for index, (chunk, text) in enumerate(digests):
+            try:
+                if not target:
+                    raise ValueError("support_group_id is not set")
+                message = self._send(target, self.format_single(chunk[0]) if len(chunk) == 1 and chunk[0].count == 1
+                                     else text)
+            except Exception as e:
+                remaining = [ticket for c, _ in digests[index:] for ticket in c]
+                if isinstance(e, telebot.apihelper.ApiTelegramException) and e.error_code in (400, 403):
+                    # bot removed from the group, chat gone, ...: retrying won't help
+                    logging.error(f"Error posting support digest, dropping {len(chunk)} tickets: {e}")
+                    METRICS.inc("tgbot_support_tickets_dropped_total", value=len(chunk))
+                    continue
+                with self.cond:
+                    delay = self._backoff(True)
+                logging.error(f"Error posting support digest, retrying {len(remaining)} tickets in {delay:.0f}s: {e}")
+                self._requeue(remaining)
+                return
+            with self.cond:
+                self._backoff(False)
+            METRICS.inc("tgbot_support_digests_total")
+            for number, ticket in enumerate(chunk, 1):
+                self.forwarded.save(f"{message.message_id}#{number}", ticket.chat_id)
+            if len(chunk) == 1:
+                # a lone ticket can be answered with a plain reply too
+                self.forwarded.save(message.message_id, chunk[0].chat_id)
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            with self.cond:
+                due = self._due()
+                now = time.time()
+                if due is None or due > now:
+                    self.cond.wait(self.POLL if due is None else min(due - now, self.POLL))
+                    continue
+                batch = self._take()
+            self._post(batch)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def close(self):
+        # post whatever is still queued instead of dropping it
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify()
+        self.thread.join(timeout=5)
+        with self.cond:
+            tickets = list(self.pending.values())
+            self.pending.clear()
+        for start in range(0, len(tickets), self.max_batch):
+            self._post(tickets[start:start + self.max_batch])
+
 # -------------------------
-def load_server_config():
-    try:
-        with open('server_config.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Error loading server config: {e}")
-        return {}
+# Conversation States
+# chat_id -> pending step of a multi-step command. One dispatcher looks the
+# state up and calls its handler; idle states expire instead of piling up.
+# -------------------------
+class ConversationStates:
+    DEFAULT_TIMEOUT = 300
+    SWEEP_INTERVAL = 60
 
-def load_user_config():
-    try:
-        with open('config.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Error loading user config: {e}")
-        return {}
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}        # chat_id -> (state, expires_at)
+        self.handlers = {}      # state -> (handler, timeout)
+        self.expire_callbacks = []
+        self.next_sweep = time.monotonic() + self.SWEEP_INTERVAL
 
-def save_user_config(user_config):
-    try:
-        with open('config.json', 'w', encoding='utf-8') as f:
-            json.dump(user_config, f, indent=4)
-    except Exception as e:
-        logging.error(f"Error saving user config: {e}")
+    def handler(self, state, timeout=None):
+        def decorator(func):
+            self.handlers[state] = (func, timeout or self.DEFAULT_TIMEOUT)
+            return func
+        return decorator
 
-def load_accounts():
-    try:
-        with open("Database/Player/accounts.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Error loading accounts: {e}")
-        return {}
+    def __setitem__(self, chat_id, state):
+        _, timeout = self.handlers.get(state, (None, self.DEFAULT_TIMEOUT))
+        with self.lock:
+            self.states[chat_id] = (state, time.monotonic() + timeout)
+        self._maybe_sweep()
 
-def save_accounts(accounts_data):
-    try:
-        with open("Database/Player/accounts.json", "w", encoding="utf-8") as f:
-            json.dump(accounts_data, f, indent=4)
-    except Exception as e:
-        logging.error(f"Error saving accounts: {e}")
+    def get(self, chat_id):
+        entry = self.states.get(chat_id)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            self._expire(chat_id, entry)
+            return None
+        return entry[0]
 
-def get_system_stats():
-    cpu_usage = psutil.cpu_percent(interval=1)
-    ram_usage = psutil.virtual_memory().percent
-    disk_usage = psutil.disk_usage('/').percent
-    return f"💾 RAM Usage: {ram_usage}%\n⚙️ CPU Usage: {cpu_usage}%\n🖴 Disk Usage: {disk_usage}%"
+    def __getitem__(self, chat_id):
+        state = self.get(chat_id)
+        if state is None:
+            raise KeyError(chat_id)
+        return state
 
-def is_admin(chat_id, admin_ids):
-    return str(chat_id) in [str(x) for x in admin_ids]
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
 
-def load_club_db():
-    try:
-        with open("Database/Club/club.db", "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Error loading club database: {e}")
-        return {}
+    def __delitem__(self, chat_id):
+        # a flow may already have been evicted; finishing it is still fine
+        with self.lock:
+            self.states.pop(chat_id, None)
+
+    def __len__(self):
+        return len(self.states)
+
+    def _expire(self, chat_id, entry):
+        with self.lock:
+            if self.states.get(chat_id) is not entry:
+                return
+            del self.states[chat_id]
+        for callback in self.expire_callbacks:
+            callback(chat_id, entry[0])
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + self.SWEEP_INTERVAL
+        for chat_id, entry in list(self.states.items()):
+            if entry[1] <= now:
+                self._expire(chat_id, entry)
+
+    def dispatch(self, msg):
+        state = self.get(msg.chat.id)
+        if state is None:
+            return
+        handler, _ = self.handlers.get(state, (None, None))
+        if handler is None:
+            del self[msg.chat.id]
+            return
+        handler(msg)
+
+# -------------------------
+# Login Sessions
+# chat_id -> logged in account ID. Entries are kept in least-recently-used
+# order, so the oldest idle sessions are dropped first, either once they pass
+# the idle TTL or when the store is full.
+# -------------------------
+class SessionStore:
+    def __init__(self, max_entries=10000, idle_ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()   # chat_id -> (account_id, last_seen)
+
+    def login(self, chat_id, account_id):
+        now = time.monotonic()
+        with self.lock:
+            self.sessions[chat_id] = (account_id, now)
+            self.sessions.move_to_end(chat_id)
+            self._evict(now)
+
+    def logout(self, chat_id):
+        with self.lock:
+            return self.sessions.pop(chat_id, None) is not None
+
+    def get(self, chat_id):
+        # the account ID for this chat, refreshing its idle timer
+        now = time.monotonic()
+        with self.lock:
+            self._evict(now)
+            entry = self.sessions.get(chat_id)
+            if entry is None:
+                return None
+            self.sessions[chat_id] = (entry[0], now)
+            self.sessions.move_to_end(chat_id)
+            return entry[0]
+
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _evict(self, now):
+        while self.sessions:
+            chat_id, (_, last_seen) = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_entries and now - last_seen < self.idle_ttl:
+                return
+            del self.sessions[chat_id]
+
+# -------------------------
+# Chat Lane Worker Pool
+# Drop-in replacement for telebot's worker pool: each chat hashes to one lane
+# (a queue + thread), so a chat's updates run in order while different chats
+# run in parallel. Admin/moderation chats get their own lanes.
+# -------------------------
+class WorkerLane:
+    def __init__(self, name):
+        self.name = name
+        self.queue = queue.Queue()
+        self.waits = deque(maxlen=256)   # recent queue wait times in seconds
+        self.busy_since = None
+        self.processed = 0
+        self.thread = None
+
+class ChatLanePool:
+    def __init__(self, telebot_instance, lanes=4, priority_lanes=2, is_priority=None):
+        self.telebot = telebot_instance
+        self.is_priority = is_priority or (lambda chat_id: False)
+        self.exception_event = threading.Event()
+        self.exception_info = None
+        self.groups = {
+            "user": [WorkerLane(f"user-{i}") for i in range(max(1, lanes))],
+            "admin": [WorkerLane(f"admin-{i}") for i in range(max(1, priority_lanes))],
+        }
+        for lanes_in_group in self.groups.values():
+            for lane in lanes_in_group:
+                lane.thread = threading.Thread(target=self._work, args=(lane,), name=f"lane-{lane.name}", daemon=True)
+                lane.thread.start()
+
+    @staticmethod
+    def chat_id_of(update):
+        chat = getattr(update, "chat", None)
+        if chat is None and getattr(update, "message", None) is not None:
+            chat = getattr(update.message, "chat", None)
+        if chat is not None:
+            return chat.id
+        user = getattr(update, "from_user", None)
+        return user.id if user is not None else 0
+
+    def lane_for(self, chat_id):
+        group = self.groups["admin" if self.is_priority(chat_id) else "user"]
+        return group[hash(chat_id) % len(group)]
+
+    def put(self, func, *args, **kwargs):
+        chat_id = self.chat_id_of(args[0]) if args else 0
+        self.lane_for(chat_id).queue.put((func, args, kwargs, time.monotonic()))
+
+    def _work(self, lane):
+        while True:
+            task = lane.queue.get()
+            if task is None:
+                break
+            func, args, kwargs, queued_at = task
+            lane.busy_since = time.monotonic()
+            lane.waits.append(lane.busy_since - queued_at)
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self.on_exception(e)
+            finally:
+                lane.busy_since = None
+                lane.processed += 1
+
+    def on_exception(self, e):
+        # same contract as telebot.util.ThreadPool
+        if self.telebot.exception_handler is not None:
+            handled = self.telebot.exception_handler.handle(e)
+        else:
+            handled = False
+        if not handled:
+            logging.error(f"Unhandled error in handler: {e}")
+            self.exception_info = e
+            self.exception_event.set()
+
+    def raise_exceptions(self):
+        if self.exception_event.is_set():
+            raise self.exception_info
+
+    def clear_exceptions(self):
+        self.exception_event.clear()
+
+    def close(self):
+        for lanes in self.groups.values():
+            for lane in lanes:
+                lane.queue.put(None)
+        for lanes in self.groups.values():
+            for lane in lanes:
+                if lane.thread is not threading.current_thread():
+                    lane.thread.join()
+
+    def stats(self):
+        result = {}
+        for group, lanes in self.groups.items():
+            waits = [wait for lane in lanes for wait in list(lane.waits)]
+            result[group] = {
+                "lanes": len(lanes),
+                "queued": sum(lane.queue.qsize() for lane in lanes),
+                "max_queued": max(lane.queue.qsize() for lane in lanes),
+                "busy": sum(1 for lane in lanes if lane.busy_since is not None),
+                "processed": sum(lane.processed for lane in lanes),
+                "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+                "max_wait": max(waits) if waits else 0.0,
+            }
+        return result
+
+# -------------------------
+# HTTP Front End
+# Small threaded HTTP server with GET routes (health, readiness, metrics, ...)
+# in self.routes. WebhookServer adds the Telegram update endpoint on top.
+# -------------------------
+class HTTPFrontend:
+    def __init__(self, host="0.0.0.0", port=8443):
+        self.ready = threading.Event()
+        self.stop_event = threading.Event()
+        self.routes = {
+            "/healthz": lambda: (200, "text/plain", "ok"),
+            "/readyz": lambda: (200, "text/plain", "ready") if self.ready.is_set() else (503, "text/plain", "not ready"),
+        }
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, content_type="text/plain", body=""):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                route = server.routes.get(self.path.split("?", 1)[0])
+                if route is None:
+                    self._reply(404, body="not found")
+                    return
+                self._reply(*route())
+
+            def do_POST(self):
+                self._reply(*server.handle_post(self))
+
+            def log_message(self, format, *args):
+                logging.debug("http: " + format % args)
+
+        return Handler
+
+    def handle_post(self, request):
+        return 404, "text/plain", "not found"
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="http-frontend", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.ready.clear()
+        self.stop_event.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# -------------------------
+# Webhook Server
+# Telegram POSTs updates to webhook_path; they are queued and handed to
+# process_new_updates in batches.
+# -------------------------
+class WebhookServer(HTTPFrontend):
+    MAX_BODY = 1 << 20   # Telegram updates are a few KB; recorded batches stay well below this
+
+    def __init__(self, bot, host="0.0.0.0", port=8443, path="/telegram", secret_token=None,
+                 batch_size=100, batch_wait=0.05, max_body=MAX_BODY):
+        if not secret_token:
+            # without it anyone who can reach the port can post updates as an admin
+            raise ValueError("webhook mode needs a secret token")
+        super().__init__(host, port)
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.max_body = max_body
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.updates = queue.Queue()
+        self.batcher = threading.Thread(target=self._batch_loop, name="webhook-batcher", daemon=True)
+        self.batcher.start()
+
+    def handle_post(self, request):
+        if request.path.split("?", 1)[0] != self.path:
+            return 404, "text/plain", "not found"
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode("utf-8"), self.secret_token.encode("utf-8")):
+            return 403, "text/plain", "forbidden"
+        try:
+            length = int(request.headers.get("Content-Length", 0))
+        except ValueError:
+            return 400, "text/plain", "bad request"
+        if length > self.max_body:
+            request.close_connection = True   # don't read the body at all
+            return 413, "text/plain", "payload too large"
+        if length < 0:
+            return 400, "text/plain", "bad request"
+        try:
+            payload = json.loads(request.rfile.read(length).decode("utf-8"))
+        except (ValueError, UnicodeDecodeError):
+            return 400, "text/plain", "bad request"
+        # a list lets recorded update batches be replayed in one POST
+        for update in payload if isinstance(payload, list) else [payload]:
+            self.updates.put(update)
+        METRICS.inc("tgbot_webhook_updates_total", value=len(payload) if isinstance(payload, list) else 1)
+        return 200, "text/plain", "ok"
+
+    def _batch_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                batch = [self.updates.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.updates.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                updates = [telebot.types.Update.de_json(update) for update in batch]
+                self.bot.process_new_updates(updates)
+            except Exception as e:
+                logging.error(f"Error processing webhook updates: {e}")
 
 # -------------------------
 # Telegram Bot Class
 # -------------------------
 class TelegramBot:
-    def __init__(self, token):
-        self.bot = telebot.TeleBot(token)
-        self.server_config = load_server_config()  # server settings & token etc.
-        self.user_config = load_user_config()        # user settings from config.json
-        self.support_group_id = self.server_config.get("support_group_id")
-        self.admin_ids = self.server_config.get("admin_ids", [])
+    def __init__(self, token, bot=None):
+        self.bot = bot if bot is not None else telebot.TeleBot(token)
+        self.config = ConfigManager()  # server_config.json & config.json, hot-reloaded
+        if self.bot.threaded:
+            self.bot.worker_pool.close()
+            self.bot.worker_pool = ChatLanePool(
+                self.bot,
+                lanes=self.server_config.get("worker_lanes", 4),
+                priority_lanes=self.server_config.get("admin_worker_lanes", 2),
+                is_priority=lambda chat_id: is_admin(chat_id, self.admin_ids) or str(chat_id) == str(self.support_group_id))
+        self.storage = open_storage(self.server_config)
+        atexit.register(self.storage.close)
+        self.accounts = self.storage.accounts
+        self.rankings = self.storage.rankings
+        self.clubs = self.storage.clubs
+        self.responses = ResponseCache(max_entries=self.server_config.get("response_cache_entries", 10000))
+        self.accounts.listeners.append(self.responses)
+        self.stats = StatsSampler(interval=self.server_config.get("stats_interval", 5),
+                                  history_minutes=self.server_config.get("stats_history_minutes", 60))
+        self.broadcaster = Broadcaster(self.bot, workers=self.server_config.get("broadcast_workers", 8),
+                                       rate=self.server_config.get("broadcast_rate", 25))
         
         # State dictionaries
-        self.user_state = {}         # For multi-step processes
-        self.logged_in_users = {}    # chat_id -> account info
-        self.all_users = set()       # All chat ids that have interacted
+        self.user_state = ConversationStates()  # For multi-step processes
+        self.sessions = SessionStore(
+            max_entries=self.server_config.get("sessions_max_entries", 10000),
+            idle_ttl=self.server_config.get("sessions_idle_hours", 168) * 3600)   # chat_id -> account ID
         self.rename_temp = {}        # Temporary storage for /rename command
-        self.usernames = {}          # chat_id -> Telegram @username or name
+        self.user_state.expire_callbacks.append(lambda chat_id, state: self.rename_temp.pop(chat_id, None))
+
+        # Persisted in JSON/users.log so the news audience and moderation survive restarts
+        self.users = UserRegistry(flush_interval=self.server_config.get("users_flush_interval", 2.0))
+        atexit.register(self.users.close)
+        self.all_users = self.users.all_users        # All chat ids that have interacted
+        self.usernames = self.users.usernames        # chat_id -> Telegram @username or name
         
         # Moderation state for support/admin messages
-        self.muted_users = {}        # chat_id -> unmute timestamp
-        self.banned_users = set()    # banned chat_ids
+        self.muted_users = self.users.muted_users    # chat_id -> unmute timestamp
+        self.banned_users = self.users.banned_users  # banned chat_ids
+        self.moderation = ModerationScheduler(self.users, self.broadcaster.sender)
+        self.forwarded = ForwardedMessageStore(
+            max_entries=self.server_config.get("forwarded_max_entries", 50000),
+            max_age_days=self.server_config.get("forwarded_max_age_days", 30))
+        atexit.register(self.forwarded.close)
+        # support messages / admin requests, posted to the support group as digests
+        self.support_inbox = SupportInbox(self.bot, self.forwarded, lambda: self.server_config)
 
         # -------------------------
         # Basic Commands
         # -------------------------
         @self.bot.message_handler(commands=['start'])
         def start(message):
-            self.all_users.add(message.chat.id)
-            if message.from_user.username:
-                self.usernames[message.chat.id] = "@" + message.from_user.username
-            elif message.from_user.first_name:
-                self.usernames[message.chat.id] = message.from_user.first_name
-            else:
-                self.usernames[message.chat.id] = str(message.chat.id)
+            self.remember_user(message)
             self.bot.send_message(message.chat.id, "Welcome to Zerux Brawl Bot! Use /help to view available commands.")
 
         @self.bot.message_handler(commands=['help'])
@@ -107,12 +2956,15 @@ class TelegramBot:
             help_text = (
                 "Available Commands:\n"
                 "/status - Show server system stats\n"
+                "/status history [minutes] - Show min/avg/max system stats (Admin Only)\n"
                 "/info - Get information about Zerux Brawl with images\n"
                 "/support - Contact the support team\n"
                 "/login - Login with your account name\n"
                 "/profile - View your profile (requires login)\n"
+                "/club [club id] - View a club (defaults to your own club)\n"
                 "/logout - Log out of your account\n"
-                "/leaderboard - View trophy leaderboard\n"
+                "/leaderboard [metric] [page] - View a leaderboard (trophies, highest, solo, duo, 3v3, gold, gems)\n"
+                "/myrank [metric] - View your leaderboard positions (requires login)\n"
                 "/rename - Change your account name\n"
                 "/adminrequest - Request admin application\n"
                 "/latest - Get the latest client download link\n\n"
@@ -123,45 +2975,59 @@ class TelegramBot:
                 "/addgems <account name> <amount> - Set gems to a specific value\n"
                 "/addgold <account name> <amount> - Set gold to a specific value\n"
                 "/addtrophy <account name> <amount> - Set trophies to a specific value\n"
+                "/bulkset <rows | where ... set ...> - Bulk set or add gems/gold/trophies/wins (or upload a CSV)\n"
                 "/resetclubs - Reset club-related files\n"
                 "/resetall - Full database reset (Clubs & Player)\n"
                 "/add_news - Send news update to all known chats (Admin Only)\n"
                 "/settheme - Set the bot theme (Admin only)\n"
-                "/unban_support <@username> - Unban a support user (Admin Only)\n"
-                "/ban_support <@username> - Ban a support user (Admin Only)\n"
-                "/mute_support <@username> <minutes> - Mute a support user for specified minutes (Admin Only)\n"
-                "/maintenance <value> - Set maintenance mode (Admin Only)"
+                "/unban_support <@username> [...] - Unban support users (Admin Only)\n"
+                "/ban_support <@username> [...] - Ban support users (Admin Only)\n"
+                "/mute_support <@username> [...] <minutes> - Mute support users for specified minutes (Admin Only)\n"
+                "/maintenance <value> - Set maintenance mode (Admin Only)\n"
+                "/queues - Show worker lane queue depth and wait times (Admin Only)\n"
+                "/metrics - Show handler latency, error and send metrics (Admin Only)"
             )
             self.bot.send_message(message.chat.id, help_text)
 
         @self.bot.message_handler(commands=['status'])
         def status(message):
             self.all_users.add(message.chat.id)
-            stats = get_system_stats()
+            parts = message.text.split()
+            if len(parts) > 1 and parts[1].lower() == "history":
+                if not is_admin(message.chat.id, self.admin_ids):
+                    self.bot.send_message(message.chat.id, "You are not authorized to use this command.")
+                    return
+                minutes = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 15
+                summary, count = self.stats.summary(minutes)
+                if not count:
+                    self.bot.send_message(message.chat.id, "No samples recorded yet.")
+                    return
+                rows = [
+                    ("⚙️ CPU", "cpu", lambda v: f"{v:.1f}%"),
+                    ("💾 RAM", "ram", lambda v: f"{v:.1f}%"),
+                    ("🖴 Disk", "disk", lambda v: f"{v:.1f}%"),
+                    ("🌐 Net ↑", "net_sent", lambda v: f"{v / 1024:.1f} KB/s"),
+                    ("🌐 Net ↓", "net_recv", lambda v: f"{v / 1024:.1f} KB/s"),
+                    ("🤖 Bot Memory", "rss", lambda v: f"{v / (1024 * 1024):.1f} MB"),
+                ]
+                history_text = f"🖥 Server Status (last {minutes} min, {count} samples, min/avg/max):\n"
+                for label, field, fmt in rows:
+                    low, avg, high = summary[field]
+                    history_text += f"{label}: {fmt(low)} / {fmt(avg)} / {fmt(high)}\n"
+                self.bot.send_message(message.chat.id, history_text)
+                return
+            stats = get_system_stats(self.stats.latest())
             self.bot.send_message(message.chat.id, f"🖥 Server Status:\n{stats}")
 
         @self.bot.message_handler(commands=['info'])
         def info(message):
             self.all_users.add(message.chat.id)
-            info_text = (
-                "Zerux Brawl tries to mimic the original Brawl Stars server to give you the OG Nostalgia of the Prime Brawl Stars times!\n"
-                "Join our community and have fun with exclusive content!\n\n"
-                f"Bot Version: {self.server_config.get('bot_version', 'Unknown')}\n"
-                f"Server Version: {self.server_config.get('server_version', 'Unknown')}\n"
-                f"Game Version: {self.server_config.get('version', 'Unknown')}\n"
-                f"Changelog: {self.server_config.get('changelog', 'No changelog available')}"
-            )
+            info_text = self.responses.render(("info",), self.config.server.signature, self.render_info)
             info_images = self.server_config.get("info_images")
             if info_images:
-                if isinstance(info_images, list) and len(info_images) > 1:
-                    media = []
-                    media.append(telebot.types.InputMediaPhoto(info_images[0], caption=info_text))
-                    for img in info_images[1:]:
-                        media.append(telebot.types.InputMediaPhoto(img))
-                    self.bot.send_media_group(message.chat.id, media)
-                else:
-                    img = info_images[0] if isinstance(info_images, list) else info_images
-                    self.bot.send_photo(message.chat.id, img, caption=info_text)
+                if not isinstance(info_images, list):
+                    info_images = [info_images]
+                self.send_info_images(message.chat.id, info_images, info_text)
             else:
                 self.bot.send_message(message.chat.id, info_text)
 
@@ -171,9 +3037,8 @@ class TelegramBot:
         @self.bot.message_handler(commands=['latest'])
         def latest(message):
             self.all_users.add(message.chat.id)
-            config = load_server_config()
             try:
-                download_link = config["download_link"]
+                download_link = self.server_config["download_link"]
             except KeyError:
                 download_link = "Download link is not configured in server_config.json!"
             msg_text = (
@@ -192,18 +3057,13 @@ class TelegramBot:
             self.bot.send_message(message.chat.id, "Please enter your account name:")
             self.user_state[message.chat.id] = "awaiting_login"
 
-        @self.bot.message_handler(func=lambda msg: msg.chat.id in self.user_state and self.user_state[msg.chat.id] == "awaiting_login")
+        @self.user_state.handler("awaiting_login", timeout=300)
         def handle_login(msg):
             self.all_users.add(msg.chat.id)
             account_name = msg.text.strip()
-            accounts_data = load_accounts()
-            account_found = None
-            for account_id, account in accounts_data.get("Accounts", {}).items():
-                if account.get("name") == account_name:
-                    account_found = account
-                    break
+            account_id, account_found = self.accounts.find_by_name(account_name)
             if account_found:
-                self.logged_in_users[msg.chat.id] = account_found
+                self.sessions.login(msg.chat.id, account_id)
                 self.bot.send_message(msg.chat.id, f"Logged in successfully! You have {account_found.get('gems', 0)} gems.")
             else:
                 self.bot.send_message(msg.chat.id, "Account not found. Please try again.")
@@ -212,8 +3072,7 @@ class TelegramBot:
         @self.bot.message_handler(commands=['logout'])
         def logout(message):
             self.all_users.add(message.chat.id)
-            if message.chat.id in self.logged_in_users:
-                del self.logged_in_users[message.chat.id]
+            if self.sessions.logout(message.chat.id):
                 self.bot.send_message(message.chat.id, "You have been logged out successfully.")
             else:
                 self.bot.send_message(message.chat.id, "You are not currently logged in.")
@@ -221,95 +3080,127 @@ class TelegramBot:
         @self.bot.message_handler(commands=['profile'])
         def profile(message):
             self.all_users.add(message.chat.id)
-            if message.chat.id not in self.logged_in_users:
+            account_id = self.sessions.get(message.chat.id)
+            if account_id is None:
                 self.bot.send_message(message.chat.id, "Please log in first using /login.")
                 return
-            account = self.logged_in_users[message.chat.id]
-            club_id = account.get("clubID", 0)
-            if club_id != 0:
-                club_db = load_club_db()
-                club_name = "Unknown Club"
-                for group in club_db.values():
-                    for club in group.values():
-                        if club.get("clubID") == club_id:
-                            club_name = club.get("info", {}).get("name", "Unknown Club")
-                            break
-                club_display = club_name
-            else:
-                club_display = "Not in club"
-            profile_text = (
-                "<b>🎮 Profile:</b>\n"
-                "<b>Account Name:</b> {name}\n"
-                "<b>Token:</b> {token}\n"
-                "<b>Low ID:</b> {lowID}\n\n"
-                "<b>🏆 Trophies:</b> {trophies} (Max: {highesttrophies})\n"
-                "<b>🎖️ Solo Wins:</b> {soloWins}\n"
-                "<b>🤝 Duo Wins:</b> {duoWins}\n"
-                "<b>⚔️ 3v3 Wins:</b> {threeWins}\n"
-                "<b>💎 Gems:</b> {gems}\n"
-                "<b>💰 Gold:</b> {gold}\n"
-                "<b>Club:</b> {club}"
-            ).format(
-                name=account.get('name', 'N/A'),
-                token=account.get('token', 'N/A'),
-                lowID=account.get('lowID', 'N/A'),
-                trophies=account.get('trophies', 0),
-                highesttrophies=account.get('highesttrophies', 0),
-                soloWins=account.get('soloWins', 0),
-                duoWins=account.get('duoWins', 0),
-                threeWins=account.get('3vs3Wins', 0),
-                gems=account.get('gems', 0),
-                gold=account.get('gold', 0),
-                club=club_display
-            )
+            # read the version before the account: a change landing in between then
+            # only leaves the cached text older than its version, never newer
+            self.accounts.refresh()
+            self.clubs.refresh()
+            version = (self.responses.account_version(account_id), self.clubs.signature)
+            account = self.accounts.get(account_id)
+            if account is None:
+                self.sessions.logout(message.chat.id)
+                self.bot.send_message(message.chat.id, "Your account could not be found in the database. Please log in again using /login.")
+                return
+            profile_text = self.responses.render(("profile", account_id), version,
+                                                 lambda: self.render_profile(account))
             self.bot.send_message(message.chat.id, profile_text, parse_mode='HTML')
 
         @self.bot.message_handler(commands=['leaderboard'])
         def leaderboard(message):
             self.all_users.add(message.chat.id)
-            accounts_data = load_accounts()
-            accounts = accounts_data.get("Accounts", {})
-            sorted_accounts = sorted(accounts.items(), key=lambda item: item[1].get("trophies", 0), reverse=True)
-            leaderboard_text = "🏆 Leaderboard (by trophies):\n"
-            for idx, (acc_id, account) in enumerate(sorted_accounts, 1):
-                leaderboard_text += f"{idx}. {account.get('name')} - {account.get('trophies', 0)} trophies\n"
-                if idx >= 10:
-                    break
+            parts = message.text.split()[1:]
+            metric = "trophies"
+            page = 1
+            if parts and not parts[0].isdigit():
+                metric = resolve_metric(parts.pop(0))
+            if metric is None or len(parts) > 1 or (parts and not parts[0].isdigit()):
+                self.bot.send_message(message.chat.id, "Usage: /leaderboard [trophies|highest|solo|duo|3v3|gold|gems] [page]")
+                return
+            if parts:
+                page = int(parts[0])
+            field, label = RANKING_METRICS[metric]
+            # refresh first so an outside write (the game server) bumps the version we key on
+            self.accounts.refresh()
+            leaderboard_text = self.responses.render(("leaderboard", field, page), self.responses.rankings_version(),
+                                                     lambda: self.render_leaderboard(field, label, page))
             self.bot.send_message(message.chat.id, leaderboard_text)
 
+        @self.bot.message_handler(commands=['myrank'])
+        def myrank(message):
+            self.all_users.add(message.chat.id)
+            account_id = self.sessions.get(message.chat.id)
+            if account_id is None:
+                self.bot.send_message(message.chat.id, "Please log in first using /login.")
+                return
+            parts = message.text.split()
+            metrics = list(RANKING_METRICS)
+            if len(parts) > 1:
+                metric = resolve_metric(parts[1])
+                if metric is None:
+                    self.bot.send_message(message.chat.id, "Usage: /myrank [trophies|highest|solo|duo|3v3|gold|gems]")
+                    return
+                metrics = [metric]
+            if self.accounts.get(account_id) is None:
+                self.bot.send_message(message.chat.id, "Your account could not be found in the database.")
+                return
+            rank_text = "📊 Your Ranks:\n"
+            for metric in metrics:
+                field, label = RANKING_METRICS[metric]
+                result = self.rankings.rank(field, account_id)
+                if result is None:
+                    continue
+                position, value, total = result
+                rank_text += f"{label.capitalize()}: #{position} of {total} ({value})\n"
+            self.bot.send_message(message.chat.id, rank_text)
+
+        @self.bot.message_handler(commands=['club'])
+        def club(message):
+            self.all_users.add(message.chat.id)
+            parts = message.text.split()
+            account_id = self.sessions.get(message.chat.id) if len(parts) == 1 else None
+            account = self.accounts.get(account_id) if account_id is not None else None
+            if len(parts) > 1:
+                club_id = parts[1]
+            elif account is not None and account.get("clubID", 0) != 0:
+                club_id = account.get("clubID")
+            else:
+                self.bot.send_message(message.chat.id, "Usage: /club <club id>")
+                return
+            club_entry = self.clubs.get(club_id)
+            if club_entry is None:
+                self.bot.send_message(message.chat.id, f"Club {club_id} not found.")
+                return
+            info = club_entry.get("info", {})
+            club_text = (
+                "<b>🛡️ Club:</b>\n"
+                f"<b>Name:</b> {html.escape(str(info.get('name', 'Unknown Club')))}\n"
+                f"<b>Club ID:</b> {html.escape(str(club_entry.get('clubID')))}\n"
+                f"<b>Description:</b> {html.escape(str(info.get('description', 'N/A')))}\n"
+                f"<b>Members:</b> {len(club_entry.get('members', {}))}"
+            )
+            self.bot.send_message(message.chat.id, club_text, parse_mode='HTML')
+
         # -------------------------
         # Rename Command (User)
         # -------------------------
         @self.bot.message_handler(commands=['rename'])
         def rename(message):
             self.all_users.add(message.chat.id)
-            if message.chat.id not in self.logged_in_users:
+            if message.chat.id not in self.sessions:
                 self.bot.send_message(message.chat.id, "Please log in first using /login.")
                 return
             self.bot.send_message(message.chat.id, "Please enter your current account name:")
             self.user_state[message.chat.id] = "awaiting_rename_current"
 
-        @self.bot.message_handler(func=lambda msg: msg.chat.id in self.user_state and self.user_state[msg.chat.id] == "awaiting_rename_current")
+        @self.user_state.handler("awaiting_rename_current", timeout=300)
         def handle_rename_current(msg):
             self.rename_temp[msg.chat.id] = msg.text.strip()
             self.bot.send_message(msg.chat.id, "Please enter your new account name:")
             self.user_state[msg.chat.id] = "awaiting_rename_new"
 
-        @self.bot.message_handler(func=lambda msg: msg.chat.id in self.user_state and self.user_state[msg.chat.id] == "awaiting_rename_new")
+        @self.user_state.handler("awaiting_rename_new", timeout=300)
         def handle_rename_new(msg):
             new_name = msg.text.strip()
             current_name = self.rename_temp.get(msg.chat.id, "")
-            account = self.logged_in_users.get(msg.chat.id)
-            if account.get("name") != current_name:
+            account_id = self.sessions.get(msg.chat.id)
+            account = self.accounts.get(account_id) if account_id is not None else None
+            if account is None or account.get("name") != current_name:
                 self.bot.send_message(msg.chat.id, "Current name does not match your account. Rename cancelled.")
             else:
-                account["name"] = new_name
-                accounts_data = load_accounts()
-                for acc_id, acc in accounts_data.get("Accounts", {}).items():
-                    if acc.get("name") == current_name:
-                        acc["name"] = new_name
-                        break
-                save_accounts(accounts_data)
+                self.accounts.update(account_id, {"name": new_name})
                 self.bot.send_message(msg.chat.id, f"Your account name has been changed to {new_name}.")
             del self.user_state[msg.chat.id]
             if msg.chat.id in self.rename_temp:
@@ -333,16 +3224,14 @@ class TelegramBot:
             self.bot.send_message(message.chat.id, f"Available Themes:\n{theme_list}\n\nSelect a theme by sending its number.")
             self.user_state[message.chat.id] = "awaiting_theme_selection"
 
-        @self.bot.message_handler(func=lambda msg: msg.chat.id in self.user_state and self.user_state[msg.chat.id] == "awaiting_theme_selection")
+        @self.user_state.handler("awaiting_theme_selection", timeout=120)
         def handle_theme_selection(msg):
-            user_conf = load_user_config()
             try:
                 theme_id = int(msg.text.strip())
                 if theme_id not in [0, 1, 2]:
                     self.bot.send_message(msg.chat.id, "Invalid theme ID. Please enter a valid number.")
                     return
-                user_conf["ThemeID"] = theme_id
-                save_user_config(user_conf)
+                self.config.user.update({"ThemeID": theme_id})
                 self.bot.send_message(msg.chat.id, f"Theme successfully set to {theme_id}.")
             except ValueError:
                 self.bot.send_message(msg.chat.id, "Please enter a valid number.")
@@ -360,21 +3249,20 @@ class TelegramBot:
                 return
             parts = message.text.split()
             if len(parts) < 2:
-                self.bot.send_message(message.chat.id, "Usage: /unban_support <@username>")
-                return
-            target_username = parts[1].strip().lstrip("@").lower()
-            unbanned = False
-            for chat_id, username in self.usernames.items():
-                if username.lstrip("@").lower() == target_username:
-                    if chat_id in self.banned_users:
-                        self.banned_users.remove(chat_id)
-                        unbanned = True
-                        self.bot.send_message(message.chat.id, f"User {username} has been unbanned.")
-                    else:
-                        self.bot.send_message(message.chat.id, f"User {username} is not banned.")
-                    break
-            if not unbanned:
-                self.bot.send_message(message.chat.id, f"User @{target_username} not found or already unbanned.")
+                self.bot.send_message(message.chat.id, "Usage: /unban_support <@username> [@username ...]")
+                return
+            results = []
+            for target in parts[1:]:
+                chat_id, ambiguous = self.find_target(target)
+                if ambiguous:
+                    results.append(ambiguous)
+                elif chat_id is None:
+                    results.append(f"User @{normalize_handle(target)} not found or already unbanned.")
+                elif self.moderation.unban(chat_id):
+                    results.append(f"User {self.usernames[chat_id]} has been unbanned.")
+                else:
+                    results.append(f"User {self.usernames[chat_id]} is not banned.")
+            self.bot.send_message(message.chat.id, "\n".join(results))
 
         @self.bot.message_handler(commands=['ban_support'])
         def ban_support(message):
@@ -384,18 +3272,24 @@ class TelegramBot:
                 return
             parts = message.text.split()
             if len(parts) < 2:
-                self.bot.send_message(message.chat.id, "Usage: /ban_support <@username>")
-                return
-            target_username = parts[1].strip().lstrip("@").lower()
-            banned = False
-            for chat_id, username in self.usernames.items():
-                if username.lstrip("@").lower() == target_username:
-                    self.banned_users.add(chat_id)
-                    banned = True
-                    self.bot.send_message(message.chat.id, f"User {username} has been banned.")
-                    break
-            if not banned:
-                self.bot.send_message(message.chat.id, f"User @{target_username} not found or already banned.")
+                self.bot.send_message(message.chat.id, "Usage: /ban_support <@username> [@username ...] [duration, e.g. 2h]")
+                return
+            targets = parts[1:]
+            seconds = parse_duration(targets[-1]) if len(targets) > 1 else None
+            if seconds is not None:
+                targets.pop()
+            results = []
+            for target in targets:
+                chat_id, ambiguous = self.find_target(target)
+                if ambiguous:
+                    results.append(ambiguous)
+                elif chat_id is None:
+                    results.append(f"User @{normalize_handle(target)} not found or already banned.")
+                else:
+                    self.moderation.ban(chat_id, seconds)
+                    duration = f" for {format_duration(seconds)}" if seconds is not None else ""
+                    results.append(f"User {self.usernames[chat_id]} has been banned{duration}.")
+            self.bot.send_message(message.chat.id, "\n".join(results))
 
         @self.bot.message_handler(commands=['mute_support'])
         def mute_support(message):
@@ -404,22 +3298,24 @@ class TelegramBot:
                 self.bot.send_message(message.chat.id, "You are not authorized to use this command.")
                 return
             parts = message.text.split()
-            if len(parts) < 3 or not parts[2].isdigit():
-                self.bot.send_message(message.chat.id, "Usage: /mute_support <@username> <minutes>")
-                return
-            target_username = parts[1].strip().lstrip("@").lower()
-            minutes = int(parts[2])
-            muted = False
-            for chat_id, username in self.usernames.items():
-                if username.lstrip("@").lower() == target_username:
-                    unmute_time = time.time() + (minutes * 60)
-                    self.muted_users[chat_id] = unmute_time
-                    muted = True
-                    self.bot.send_message(message.chat.id, f"User {username} has been muted for {minutes} minutes.")
-                    self.bot.send_message(chat_id, f"You have been muted for {minutes} minutes by an admin.")
-                    break
-            if not muted:
-                self.bot.send_message(message.chat.id, f"User @{target_username} not found.")
+            seconds = parse_duration(parts[-1]) if len(parts) >= 3 else None
+            if not seconds:
+                self.bot.send_message(message.chat.id, "Usage: /mute_support <@username> [@username ...] <minutes, or e.g. 2h>")
+                return
+            duration = format_duration(seconds)
+            results = []
+            for target in parts[1:-1]:
+                chat_id, ambiguous = self.find_target(target)
+                if ambiguous:
+                    results.append(ambiguous)
+                    continue
+                if chat_id is None:
+                    results.append(f"User @{normalize_handle(target)} not found.")
+                    continue
+                self.moderation.mute(chat_id, seconds)
+                results.append(f"User {self.usernames[chat_id]} has been muted for {duration}.")
+                self.bot.send_message(chat_id, f"You have been muted for {duration} by an admin.")
+            self.bot.send_message(message.chat.id, "\n".join(results))
 
         # -------------------------
         # Support System & Admin Requests
@@ -427,25 +3323,20 @@ class TelegramBot:
         @self.bot.message_handler(commands=['support'])
         def support(message):
             self.all_users.add(message.chat.id)
-            if message.chat.id in self.banned_users:
+            if self.moderation.is_banned(message.chat.id):
                 return
-            if message.chat.id in self.muted_users and time.time() < self.muted_users[message.chat.id]:
+            if self.moderation.is_muted(message.chat.id):
                 self.bot.send_message(message.chat.id, "You are muted and cannot send support messages at this time.")
                 return
             self.bot.send_message(message.chat.id, "Please enter your support message to send to the developer team:")
             self.user_state[message.chat.id] = "awaiting_support"
 
-        @self.bot.message_handler(func=lambda msg: msg.chat.id in self.user_state and self.user_state[msg.chat.id] == "awaiting_support")
+        @self.user_state.handler("awaiting_support", timeout=900)
         def handle_support_message(msg):
             self.all_users.add(msg.chat.id)
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             sender = self.get_formatted_username(msg.chat.id, msg)
-            forward_text = f"Support message received at: {timestamp}\nSender: {sender}\nMessage Content: \"{msg.text}\""
-            target_id = self.support_group_id
-            if target_id:
-                forwarded_message = self.bot.send_message(target_id, forward_text)
+            if self.support_inbox.submit("support", msg.chat.id, sender, msg.text):
                 self.bot.reply_to(msg, f"Your message has been sent to the developer team!\n(Sender: {sender})")
-                self.save_forwarded_message(forwarded_message.message_id, msg.chat.id)
             else:
                 self.bot.reply_to(msg, "Failed to send message. Please try again.")
             del self.user_state[msg.chat.id]
@@ -473,21 +3364,24 @@ class TelegramBot:
             self.bot.send_message(message.chat.id, "Please enter your admin application to send to the developer team:")
             self.user_state[message.chat.id] = "awaiting_admin_request"
 
-        @self.bot.message_handler(func=lambda msg: msg.chat.id in self.user_state and self.user_state[msg.chat.id] == "awaiting_admin_request")
+        @self.user_state.handler("awaiting_admin_request", timeout=1800)
         def handle_admin_request(msg):
             self.all_users.add(msg.chat.id)
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             sender = self.get_formatted_username(msg.chat.id, msg)
-            forward_text = f"Admin request received at: {timestamp}\nSender: {sender}\nRequest Content: \"{msg.text}\""
-            target_id = self.support_group_id
-            if target_id:
-                forwarded_message = self.bot.send_message(target_id, forward_text)
+            if self.support_inbox.submit("admin_request", msg.chat.id, sender, msg.text):
                 self.bot.reply_to(msg, f"Your admin application has been sent to the developer team!\n(Sender: {sender})")
-                self.save_forwarded_message(forwarded_message.message_id, msg.chat.id)
             else:
                 self.bot.reply_to(msg, "Failed to send application. Please try again.")
             del self.user_state[msg.chat.id]
 
+        # -------------------------
+        # Multi-step replies (login, rename, theme, support, admin request, news)
+        # Registered after the commands so a command always wins over a pending step.
+        # -------------------------
+        @self.bot.message_handler(func=lambda msg: msg.chat.id in self.user_state)
+        def handle_state(msg):
+            self.user_state.dispatch(msg)
+
         # -------------------------
         # Reply Handler for Support/Admin Moderation
         # (Now supports /ban_support, /unban_support, /mute_support when replying to forwarded messages)
@@ -496,12 +3390,14 @@ class TelegramBot:
         def handle_reply(m):
             self.all_users.add(m.chat.id)
             original_message_id = m.reply_to_message.message_id
-            user_chat_id = self.get_user_chat_id(original_message_id)
+            user_chat_id, reply_text = self.resolve_reply(original_message_id, (m.text or "").strip())
+            if user_chat_id is None and self.get_user_chat_id(f"{original_message_id}#1") is not None:
+                self.bot.send_message(m.chat.id, "This is a support digest. Start your reply with the ticket number, e.g. #2 <your answer>.")
+                return
             sender = self.get_formatted_username(m.chat.id, m)
-            if m.chat.id in self.admin_ids:
+            if is_admin(m.chat.id, self.admin_ids):
                 sender += " from Support Team"
             if user_chat_id:
-                reply_text = m.text.strip()
                 lower_reply = reply_text.lower()
                 if lower_reply.startswith("accept"):
                     try:
@@ -516,20 +3412,24 @@ class TelegramBot:
                     self.bot.send_message(m.chat.id, f"Decline message sent by {sender}.")
                 elif lower_reply.startswith("mute") or lower_reply.startswith("/mute_support"):
                     parts = reply_text.split()
-                    if len(parts) < 2 or not parts[1].isdigit():
-                        self.bot.send_message(m.chat.id, "Invalid mute command. Use: mute <minutes> or /mute_support <@username> <minutes>")
+                    seconds = parse_duration(parts[-1]) if len(parts) >= 2 else None
+                    if not seconds:
+                        self.bot.send_message(m.chat.id, "Invalid mute command. Use: mute <minutes or e.g. 2h> or /mute_support <@username> <minutes>")
                     else:
-                        minutes = int(parts[1])
-                        unmute_time = time.time() + (minutes * 60)
-                        self.muted_users[user_chat_id] = unmute_time
-                        self.bot.send_message(m.chat.id, f"User muted for {minutes} minutes by {sender}.")
-                        self.bot.send_message(user_chat_id, f"You have been muted for {minutes} minutes by {sender}.")
+                        duration = format_duration(seconds)
+                        self.moderation.mute(user_chat_id, seconds)
+                        self.bot.send_message(m.chat.id, f"User muted for {duration} by {sender}.")
+                        self.bot.send_message(user_chat_id, f"You have been muted for {duration} by {sender}.")
                 elif lower_reply.startswith("ban") or lower_reply.startswith("/ban_support"):
-                    self.banned_users.add(user_chat_id)
-                    self.bot.send_message(m.chat.id, f"User banned by {sender}.")
+                    parts = reply_text.split()
+                    seconds = parse_duration(parts[-1]) if len(parts) >= 2 else None
+                    self.moderation.ban(user_chat_id, seconds)
+                    if seconds is None:
+                        self.bot.send_message(m.chat.id, f"User banned by {sender}.")
+                    else:
+                        self.bot.send_message(m.chat.id, f"User banned for {format_duration(seconds)} by {sender}.")
                 elif lower_reply.startswith("unban") or lower_reply.startswith("/unban_support"):
-                    if user_chat_id in self.banned_users:
-                        self.banned_users.remove(user_chat_id)
+                    if self.moderation.unban(user_chat_id):
                         self.bot.send_message(m.chat.id, f"User unbanned by {sender}.")
                     else:
                         self.bot.send_message(m.chat.id, "User is not banned.")
@@ -556,11 +3456,38 @@ class TelegramBot:
                 self.bot.send_message(message.chat.id, "usage: /maintenance <value>")
                 return
             new_value = True if arg == "true" else False
-            config = load_user_config()
-            config["Maintenance"] = new_value
-            save_user_config(config)
+            self.config.user.update({"Maintenance": new_value})
             self.bot.send_message(message.chat.id, f"Maintenance mode has been set to {new_value}.")
 
+        # -------------------------
+        # /queues Command (Admin Only)
+        # -------------------------
+        @self.bot.message_handler(commands=['queues'])
+        def queues(message):
+            self.all_users.add(message.chat.id)
+            if not is_admin(message.chat.id, self.admin_ids):
+                self.bot.send_message(message.chat.id, "You are not authorized to use this command.")
+                return
+            if not isinstance(getattr(self.bot, "worker_pool", None), ChatLanePool):
+                self.bot.send_message(message.chat.id, "Worker lanes are not enabled.")
+                return
+            queues_text = "🧵 Worker Lanes:\n"
+            for group, stats in self.bot.worker_pool.stats().items():
+                queues_text += (
+                    f"{group}: {stats['lanes']} lanes, {stats['busy']} busy, "
+                    f"{stats['queued']} queued (max {stats['max_queued']} per lane), "
+                    f"{stats['processed']} done, wait avg {stats['avg_wait'] * 1000:.0f} ms / max {stats['max_wait'] * 1000:.0f} ms\n"
+                )
+            self.bot.send_message(message.chat.id, queues_text)
+
+        @self.bot.message_handler(commands=['metrics'])
+        def metrics(message):
+            self.all_users.add(message.chat.id)
+            if not is_admin(message.chat.id, self.admin_ids):
+                self.bot.send_message(message.chat.id, "You are not authorized to use this command.")
+                return
+            self.bot.send_message(message.chat.id, self.metrics_summary())
+
         # -------------------------
         # Admin Commands (Existing)
         # -------------------------
@@ -571,11 +3498,10 @@ class TelegramBot:
                 self.bot.send_message(message.chat.id, "You are not authorized to use this command.")
                 return
             try:
-                if os.path.exists("Database/Player/accounts.json"):
-                    os.remove("Database/Player/accounts.json")
-                    self.bot.send_message(message.chat.id, "Accounts database has been reset (accounts.json deleted).")
+                if self.storage.reset_accounts():
+                    self.bot.send_message(message.chat.id, "Accounts database has been reset.")
                 else:
-                    self.bot.send_message(message.chat.id, "Accounts database file does not exist.")
+                    self.bot.send_message(message.chat.id, "Accounts database is already empty.")
             except Exception as e:
                 self.bot.send_message(message.chat.id, f"Error resetting accounts database: {e}")
 
@@ -589,16 +3515,9 @@ class TelegramBot:
             if not account_name:
                 self.bot.send_message(message.chat.id, "Usage: /resetgems <account name>")
                 return
-            accounts_data = load_accounts()
-            accounts = accounts_data.get("Accounts", {})
-            found = False
-            for acc_id, account in accounts.items():
-                if account.get("name") == account_name:
-                    account["gems"] = 0
-                    found = True
-                    break
-            if found:
-                save_accounts(accounts_data)
+            account_id, _ = self.accounts.find_by_name(account_name)
+            if account_id is not None:
+                self.accounts.update(account_id, {"gems": 0})
                 self.bot.send_message(message.chat.id, f"Gems for account '{account_name}' have been reset to 0.")
             else:
                 self.bot.send_message(message.chat.id, f"Account '{account_name}' not found.")
@@ -613,18 +3532,9 @@ class TelegramBot:
             if not account_name:
                 self.bot.send_message(message.chat.id, "Usage: /reset <account name>")
                 return
-            accounts_data = load_accounts()
-            accounts = accounts_data.get("Accounts", {})
-            found = False
-            for acc_id, account in accounts.items():
-                if account.get("name") == account_name:
-                    account["gems"] = 0
-                    account["gold"] = 0
-                    account["trophies"] = 0
-                    found = True
-                    break
-            if found:
-                save_accounts(accounts_data)
+            account_id, _ = self.accounts.find_by_name(account_name)
+            if account_id is not None:
+                self.accounts.update(account_id, {"gems": 0, "gold": 0, "trophies": 0})
                 self.bot.send_message(message.chat.id, f"Account '{account_name}' has been reset (gems, gold, trophies set to 0).")
             else:
                 self.bot.send_message(message.chat.id, f"Account '{account_name}' not found.")
@@ -645,16 +3555,9 @@ class TelegramBot:
                 self.bot.send_message(message.chat.id, "Amount must be an integer.")
                 return
             account_name = " ".join(parts[1:-1])
-            accounts_data = load_accounts()
-            accounts = accounts_data.get("Accounts", {})
-            found = False
-            for acc_id, account in accounts.items():
-                if account.get("name") == account_name:
-                    account["gems"] = amount
-                    found = True
-                    break
-            if found:
-                save_accounts(accounts_data)
+            account_id, _ = self.accounts.find_by_name(account_name)
+            if account_id is not None:
+                self.accounts.update(account_id, {"gems": amount})
                 self.bot.send_message(message.chat.id, f"Gems for account '{account_name}' have been set to {amount}.")
             else:
                 self.bot.send_message(message.chat.id, f"Account '{account_name}' not found.")
@@ -675,16 +3578,9 @@ class TelegramBot:
                 self.bot.send_message(message.chat.id, "Amount must be an integer.")
                 return
             account_name = " ".join(parts[1:-1])
-            accounts_data = load_accounts()
-            accounts = accounts_data.get("Accounts", {})
-            found = False
-            for acc_id, account in accounts.items():
-                if account.get("name") == account_name:
-                    account["gold"] = amount
-                    found = True
-                    break
-            if found:
-                save_accounts(accounts_data)
+            account_id, _ = self.accounts.find_by_name(account_name)
+            if account_id is not None:
+                self.accounts.update(account_id, {"gold": amount})
                 self.bot.send_message(message.chat.id, f"Gold for account '{account_name}' has been set to {amount}.")
             else:
                 self.bot.send_message(message.chat.id, f"Account '{account_name}' not found.")
@@ -705,36 +3601,53 @@ class TelegramBot:
                 self.bot.send_message(message.chat.id, "Amount must be an integer.")
                 return
             account_name = " ".join(parts[1:-1])
-            accounts_data = load_accounts()
-            accounts = accounts_data.get("Accounts", {})
-            found = False
-            for acc_id, account in accounts.items():
-                if account.get("name") == account_name:
-                    account["trophies"] = amount
-                    if amount > account.get("highesttrophies", 0):
-                        account["highesttrophies"] = amount
-                    found = True
-                    break
-            if found:
-                save_accounts(accounts_data)
+            account_id, account = self.accounts.find_by_name(account_name)
+            if account_id is not None:
+                changes = {"trophies": amount}
+                if amount > account.get("highesttrophies", 0):
+                    changes["highesttrophies"] = amount
+                self.accounts.update(account_id, changes)
                 self.bot.send_message(message.chat.id, f"Trophies for account '{account_name}' have been set to {amount}.")
             else:
                 self.bot.send_message(message.chat.id, f"Account '{account_name}' not found.")
 
+        @self.bot.message_handler(commands=['bulkset'])
+        def bulkset(message):
+            self.all_users.add(message.chat.id)
+            if not is_admin(message.chat.id, self.admin_ids):
+                self.bot.send_message(message.chat.id, "You are not authorized to use this command.")
+                return
+            text = message.text.split(maxsplit=1)
+            if len(text) < 2:
+                self.bot.send_message(message.chat.id, BULK_USAGE)
+                return
+            self.run_bulk(message.chat.id, text[1])
+
+        @self.bot.message_handler(content_types=['document'],
+                                  func=lambda msg: (msg.caption or "").split(maxsplit=1)[:1] == ["/bulkset"])
+        def bulkset_document(message):
+            self.all_users.add(message.chat.id)
+            if not is_admin(message.chat.id, self.admin_ids):
+                self.bot.send_message(message.chat.id, "You are not authorized to use this command.")
+                return
+            if message.document.file_size and message.document.file_size > 5 * 1024 * 1024:
+                self.bot.send_message(message.chat.id, "CSV file is too large (max 5 MB).")
+                return
+            try:
+                file_info = self.bot.get_file(message.document.file_id)
+                text = self.bot.download_file(file_info.file_path).decode("utf-8-sig")
+            except Exception as e:
+                self.bot.send_message(message.chat.id, f"Error reading CSV file: {e}")
+                return
+            self.run_bulk(message.chat.id, text)
+
         @self.bot.message_handler(commands=['resetclubs'])
         def resetclubs(message):
             self.all_users.add(message.chat.id)
             if not is_admin(message.chat.id, self.admin_ids):
                 self.bot.send_message(message.chat.id, "You are not authorized to use this command.")
                 return
-            files = ["Database/Club/club.db", "Database/Club/clubs.json", "Database/Club/chat.db", "Database/Club/chats.json"]
-            errors = []
-            for file_path in files:
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except Exception as e:
-                    errors.append(f"Error deleting {file_path}: {e}")
+            errors = self.storage.reset_clubs()
             if errors:
                 self.bot.send_message(message.chat.id, "\n".join(errors))
             else:
@@ -746,18 +3659,11 @@ class TelegramBot:
             if not is_admin(message.chat.id, self.admin_ids):
                 self.bot.send_message(message.chat.id, "You are not authorized to use this command.")
                 return
-            dirs = ["Database/Clubs", "Database/Player"]
-            errors = []
-            for dir_path in dirs:
-                try:
-                    if os.path.exists(dir_path):
-                        shutil.rmtree(dir_path)
-                except Exception as e:
-                    errors.append(f"Error deleting {dir_path}: {e}")
+            errors = self.storage.reset_all()
             if errors:
                 self.bot.send_message(message.chat.id, "\n".join(errors))
             else:
-                self.bot.send_message(message.chat.id, "Full database has been reset (Clubs and Player directories removed).")
+                self.bot.send_message(message.chat.id, "Full database has been reset.")
 
         # -------------------------
         # Add News Command (Admin Only)
@@ -771,33 +3677,219 @@ class TelegramBot:
             self.bot.send_message(message.chat.id, "Please enter the news message to send to all known chats:")
             self.user_state[message.chat.id] = "awaiting_news"
 
-        @self.bot.message_handler(func=lambda msg: msg.chat.id in self.user_state and self.user_state[msg.chat.id] == "awaiting_news")
+        @self.user_state.handler("awaiting_news", timeout=600)
         def handle_news(msg):
             self.all_users.add(msg.chat.id)
             news_text = msg.text
             all_chats = set(self.all_users)
             if self.support_group_id:
                 all_chats.add(self.support_group_id)
-            for chat_id in all_chats:
-                try:
-                    self.bot.send_message(chat_id, f"📰 News Update:\n{news_text}")
-                except Exception as e:
-                    logging.error(f"Failed to send news to {chat_id}: {e}")
-            self.bot.send_message(msg.chat.id, "News has been sent to all known chats!")
             del self.user_state[msg.chat.id]
+            self.bot.send_message(msg.chat.id, f"Sending news to {len(all_chats)} chats in the background...")
+            self.broadcaster.start(all_chats, f"📰 News Update:\n{news_text}", msg.chat.id)
 
         # -------------------------
         # Log all messages and store usernames
         # -------------------------
         @self.bot.message_handler(func=lambda msg: True)
         def log_user(msg):
-            self.all_users.add(msg.chat.id)
-            if msg.from_user.username:
-                self.usernames[msg.chat.id] = "@" + msg.from_user.username
-            elif msg.from_user.first_name:
-                self.usernames[msg.chat.id] = msg.from_user.first_name
-            else:
-                self.usernames[msg.chat.id] = str(msg.chat.id)
+            self.remember_user(msg)
+
+        if self.server_config.get("metrics", True):
+            self.instrument()
+
+    # -------------------------
+    # Live configuration (always the latest validated file contents)
+    # -------------------------
+    @property
+    def server_config(self):
+        return self.config.server.data
+
+    @property
+    def user_config(self):
+        return self.config.user.data
+
+    @property
+    def admin_ids(self):
+        return self.config.admin_ids
+
+    @property
+    def support_group_id(self):
+        return self.config.server.get("support_group_id")
+
+    # -------------------------
+    # Cached responses (/profile, /leaderboard, /info)
+    # -------------------------
+    def render_profile(self, account):
+        club_id = account.get("clubID", 0)
+        if club_id != 0:
+            club = self.clubs.get(club_id)
+            club_display = club.get("info", {}).get("name", "Unknown Club") if club else "Unknown Club"
+        else:
+            club_display = "Not in club"
+        # names come from players, and the message is sent with parse_mode='HTML'
+        return (
+            "<b>🎮 Profile:</b>\n"
+            "<b>Account Name:</b> {name}\n"
+            "<b>Token:</b> {token}\n"
+            "<b>Low ID:</b> {lowID}\n\n"
+            "<b>🏆 Trophies:</b> {trophies} (Max: {highesttrophies})\n"
+            "<b>🎖️ Solo Wins:</b> {soloWins}\n"
+            "<b>🤝 Duo Wins:</b> {duoWins}\n"
+            "<b>⚔️ 3v3 Wins:</b> {threeWins}\n"
+            "<b>💎 Gems:</b> {gems}\n"
+            "<b>💰 Gold:</b> {gold}\n"
+            "<b>Club:</b> {club}"
+        ).format(
+            name=html.escape(str(account.get('name', 'N/A'))),
+            token=html.escape(str(account.get('token', 'N/A'))),
+            lowID=html.escape(str(account.get('lowID', 'N/A'))),
+            trophies=account.get('trophies', 0),
+            highesttrophies=account.get('highesttrophies', 0),
+            soloWins=account.get('soloWins', 0),
+            duoWins=account.get('duoWins', 0),
+            threeWins=account.get('3vs3Wins', 0),
+            gems=account.get('gems', 0),
+            gold=account.get('gold', 0),
+            club=html.escape(str(club_display))
+        )
+
+    def render_leaderboard(self, field, label, page):
+        rows, page, pages = self.rankings.page(field, page)
+        leaderboard_text = f"🏆 Leaderboard (by {label}) - page {page}/{pages}:\n"
+        for idx, acc_id, value in rows:
+            leaderboard_text += f"{idx}. {(self.accounts.get(acc_id) or {}).get('name')} - {value} {label}\n"
+        return leaderboard_text
+
+    def render_info(self):
+        return (
+            "Zerux Brawl tries to mimic the original Brawl Stars server to give you the OG Nostalgia of the Prime Brawl Stars times!\n"
+            "Join our community and have fun with exclusive content!\n\n"
+            f"Bot Version: {self.server_config.get('bot_version', 'Unknown')}\n"
+            f"Server Version: {self.server_config.get('server_version', 'Unknown')}\n"
+            f"Game Version: {self.server_config.get('version', 'Unknown')}\n"
+            f"Changelog: {self.server_config.get('changelog', 'No changelog available')}"
+        )
+
+    def send_info_images(self, chat_id, images, caption):
+        # reuse the file_ids from the first upload so Telegram doesn't fetch the urls again
+        cached = any(self.responses.media(url) != url for url in images)
+        try:
+            sent = self._send_images(chat_id, [self.responses.media(url) for url in images], caption)
+        except telebot.apihelper.ApiTelegramException:
+            if not cached:
+                raise
+            self.responses.forget_media(images)
+            sent = self._send_images(chat_id, images, caption)
+        self.responses.remember_media(images, sent)
+
+    def _send_images(self, chat_id, media, caption):
+        if len(media) > 1:
+            group = [telebot.types.InputMediaPhoto(media[0], caption=caption)]
+            group += [telebot.types.InputMediaPhoto(item) for item in media[1:]]
+            return self.bot.send_media_group(chat_id, group)
+        return [self.bot.send_photo(chat_id, media[0], caption=caption)]
+
+    # -------------------------
+    # Metrics instrumentation (handlers, outbound sends, gauges)
+    # -------------------------
+    def instrument(self):
+        for handler in self.bot.message_handlers:
+            func = handler["function"]
+            handler["function"] = METRICS.wrap("tgbot_handler", func, (("handler", func.__name__),))
+        for state, (func, timeout) in list(self.user_state.handlers.items()):
+            self.user_state.handlers[state] = (METRICS.wrap("tgbot_handler", func, (("handler", func.__name__),)), timeout)
+        # reply_to goes through send_message, so it is not wrapped separately
+        for method in ("send_message", "send_photo", "send_media_group"):
+            setattr(self.bot, method, self.instrument_send(method, getattr(self.bot, method)))
+        METRICS.gauge("tgbot", self.metric_gauges)
+
+    def instrument_send(self, method, func):
+        labels = (("method", method),)
+
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except telebot.apihelper.ApiTelegramException as e:
+                METRICS.inc("tgbot_send_errors_total", labels + (("code", str(e.error_code)),))
+                if e.error_code == 429:
+                    METRICS.inc("tgbot_send_rate_limited_total", labels)
+                raise
+            except Exception as e:
+                METRICS.inc("tgbot_send_errors_total", labels + (("code", type(e).__name__),))
+                raise
+            finally:
+                METRICS.inc("tgbot_send_calls_total", labels)
+                METRICS.observe("tgbot_send_latency_seconds", time.perf_counter() - started, labels)
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def metric_gauges(self):
+        samples = [
+            ("tgbot_known_chats", (), len(self.all_users)),
+            ("tgbot_logged_in_users", (), len(self.sessions)),
+            ("tgbot_response_cache_entries", (), len(self.responses)),
+            ("tgbot_active_punishments", (), len(self.moderation)),
+            ("tgbot_support_inbox_queued", (), len(self.support_inbox)),
+            ("tgbot_pending_conversations", (), len(self.user_state)),
+            ("tgbot_pending_account_writes", (), len(self.accounts.pending)),
+        ]
+        if isinstance(getattr(self.bot, "worker_pool", None), ChatLanePool):
+            for group, stats in self.bot.worker_pool.stats().items():
+                labels = (("group", group),)
+                samples.append(("tgbot_lane_queued", labels, stats["queued"]))
+                samples.append(("tgbot_lane_busy", labels, stats["busy"]))
+                samples.append(("tgbot_lane_max_wait_seconds", labels, stats["max_wait"]))
+        return samples
+
+    def metrics_summary(self):
+        counters, histograms = METRICS.snapshot()
+        handler_rows = []
+        for (name, labels), histogram in histograms.items():
+            if name == "tgbot_handler_latency_seconds":
+                handler = dict(labels)["handler"]
+                calls = sum(histogram[:-1])
+                errors = sum(value for (counter, counter_labels), value in counters.items()
+                             if counter == "tgbot_handler_errors_total" and dict(counter_labels).get("handler") == handler)
+                handler_rows.append((calls, handler, errors, histogram))
+        text = "📈 Handler Metrics (calls / errors / avg / p95):\n"
+        for calls, handler, errors, histogram in sorted(handler_rows, reverse=True)[:15]:
+            text += f"{handler}: {calls} / {errors} / {histogram[-1] / calls * 1000:.1f} ms / ≤{METRICS.quantile(histogram, 0.95) * 1000:.0f} ms\n"
+        send_calls = sum(sum(h[:-1]) for (name, _), h in histograms.items() if name == "tgbot_send_latency_seconds")
+        send_time = sum(h[-1] for (name, _), h in histograms.items() if name == "tgbot_send_latency_seconds")
+        rate_limited = sum(v for (name, _), v in counters.items() if name == "tgbot_send_rate_limited_total")
+        send_errors = sum(v for (name, _), v in counters.items() if name == "tgbot_send_errors_total")
+        text += f"\n📤 Sends: {send_calls}, avg {send_time / send_calls * 1000 if send_calls else 0:.1f} ms, errors {send_errors}, 429s {rate_limited}\n"
+        for (name, labels), histogram in histograms.items():
+            if name == "tgbot_file_load_seconds":
+                loads = sum(histogram[:-1])
+                text += f"📂 {dict(labels)['file']} loads: {loads}, avg {histogram[-1] / loads * 1000:.1f} ms\n"
+        return text
+
+    # -------------------------
+    # Known chats and their usernames (keeps the handle index in sync)
+    # -------------------------
+    def remember_user(self, message):
+        self.all_users.add(message.chat.id)
+        if message.from_user.username:
+            self.usernames[message.chat.id] = "@" + message.from_user.username
+        elif message.from_user.first_name:
+            self.usernames[message.chat.id] = message.from_user.first_name
+        else:
+            self.usernames[message.chat.id] = str(message.chat.id)
+
+    def find_target(self, target):
+        # (chat_id, None), (None, None) if unknown, or (None, message) when the
+        # handle is shared; a known chat id can always be given instead
+        handle = normalize_handle(target)
+        if handle.lstrip("-").isdigit() and int(handle) in self.usernames:
+            return int(handle), None
+        chat_ids = self.usernames.find(handle)
+        if len(chat_ids) > 1:
+            return None, (f"User @{handle} matches {len(chat_ids)} chats ({', '.join(map(str, chat_ids))}), "
+                          "use the chat id instead.")
+        return (chat_ids[0] if chat_ids else None), None
 
     # -------------------------
     # Helper method to format usernames with '@'
@@ -820,22 +3912,125 @@ class TelegramBot:
     # Helpers for forwarded messages
     # -------------------------
     def save_forwarded_message(self, forwarded_message_id, user_chat_id):
-        try:
-            with open("JSON/forwarded_messages.json", "r", encoding="utf-8") as file:
-                data = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            data = {}
-        data[str(forwarded_message_id)] = user_chat_id
-        with open("JSON/forwarded_messages.json", "w", encoding="utf-8") as file:
-            json.dump(data, file)
+        self.forwarded.save(forwarded_message_id, user_chat_id)
 
     def get_user_chat_id(self, forwarded_message_id):
-        try:
-            with open("JSON/forwarded_messages.json", "r", encoding="utf-8") as file:
-                data = json.load(file)
-            return data.get(str(forwarded_message_id))
-        except (FileNotFoundError, json.JSONDecodeError):
-            return None
+        return self.forwarded.get(forwarded_message_id)
+
+    def resolve_reply(self, forwarded_message_id, text):
+        # (user chat id, reply text); "#<n> ..." picks ticket n of a support digest
+        ref = TICKET_REF_RE.match(text)
+        if ref:
+            user_chat_id = self.get_user_chat_id(f"{forwarded_message_id}#{ref.group(1)}")
+            if user_chat_id is not None:
+                return user_chat_id, ref.group(2).strip()
+        return self.get_user_chat_id(forwarded_message_id), text
+
+    # -------------------------
+    # Bulk admin operations (/bulkset)
+    # -------------------------
+    def run_bulk(self, chat_id, text):
+        filter_match = BULK_FILTER_RE.match(text.strip())
+        if filter_match:
+            self.run_bulk_filter(chat_id, *filter_match.groups())
+            return
+        rows = parse_bulk_rows(text)
+        if not rows:
+            self.bot.send_message(chat_id, BULK_USAGE)
+            return
+        changes_by_account, not_found, errors = stage_bulk_rows(self.accounts, rows)
+        updated = self.accounts.update_many(changes_by_account)
+        summary = f"✅ Bulk update done: {len(rows)} rows, {updated} accounts updated."
+        if not_found:
+            summary += f"\nNot found ({len(not_found)}): " + ", ".join(not_found[:30])
+            if len(not_found) > 30:
+                summary += f" and {len(not_found) - 30} more"
+        if errors:
+            summary += f"\nSkipped ({len(errors)}):\n" + "\n".join(errors[:20])
+            if len(errors) > 20:
+                summary += f"\n... and {len(errors) - 20} more"
+        self.bot.send_message(chat_id, summary)
+
+    def run_bulk_filter(self, chat_id, filter_field_name, operator, threshold, field_name, value_text):
+        filter_field = resolve_economy_field(filter_field_name)
+        field = resolve_economy_field(field_name)
+        if filter_field is None or field is None:
+            self.bot.send_message(chat_id, f"Unknown field. Use one of: {', '.join(RANKING_METRICS)}")
+            return
+        amount, relative = parse_amount(value_text)
+        compare = BULK_OPERATORS[operator]
+        threshold = int(threshold)
+        changes_by_account = {}
+        for account_id, account in self.accounts.items():
+            if compare(metric_value(account, filter_field), threshold):
+                stage_amount(account, changes_by_account.setdefault(account_id, {}), field, amount, relative)
+        updated = self.accounts.update_many(changes_by_account)
+        self.bot.send_message(chat_id, f"✅ Bulk update done: {updated} accounts with {filter_field} {operator} {threshold} had {field} {'changed by' if relative else 'set to'} {value_text}.")
 
     def run(self):
-        self.bot.infinity_polling()
+        try:
+            if self.server_config.get("mode", "polling") == "webhook":
+                self.run_webhook()
+            else:
+                self.start_metrics_server()
+                self.bot.infinity_polling()
+        finally:
+            self.shutdown()
+
+    def start_metrics_server(self):
+        # polling mode has no HTTP server of its own, so /metrics gets a small one
+        port = self.server_config.get("metrics_port", 9108)
+        if not port or not self.server_config.get("metrics", True):
+            return
+        try:
+            self.metrics_server = HTTPFrontend(self.server_config.get("metrics_host", "127.0.0.1"), port)
+        except OSError as e:
+            logging.error(f"Error starting the metrics server on port {port}: {e}")
+            return
+        self.metrics_server.routes["/metrics"] = lambda: (200, "text/plain; version=0.0.4", METRICS.render_prometheus())
+        self.metrics_server.ready.set()
+        self.metrics_server.start()
+
+    def run_webhook(self):
+        webhook_url = self.server_config.get("webhook_url", "")
+        secret_token = self.server_config.get("webhook_secret", "")
+        if not secret_token:
+            if not webhook_url:
+                raise ValueError("webhook mode without webhook_url needs a webhook_secret for local clients")
+            # random per run; Telegram learns it from set_webhook below
+            secret_token = secrets.token_urlsafe(32)
+            logging.warning("webhook_secret is empty, using a random secret for this run")
+        self.webhook = WebhookServer(
+            self.bot,
+            host=self.server_config.get("webhook_host", "0.0.0.0"),
+            port=self.server_config.get("webhook_port", 8443),
+            path=self.server_config.get("webhook_path", "/telegram"),
+            secret_token=secret_token,
+            batch_size=self.server_config.get("webhook_batch_size", 100),
+            max_body=self.server_config.get("webhook_max_body", WebhookServer.MAX_BODY))
+        if self.server_config.get("webhook_metrics", False) and self.server_config.get("metrics", True):
+            # off by default: the webhook port is usually public
+            self.webhook.routes["/metrics"] = lambda: (200, "text/plain; version=0.0.4", METRICS.render_prometheus())
+        else:
+            self.start_metrics_server()
+        try:
+            # without a public url the server just listens locally (e.g. for replaying recorded updates)
+            if webhook_url:
+                self.bot.remove_webhook()
+                self.bot.set_webhook(url=webhook_url, secret_token=secret_token)
+            self.webhook.ready.set()
+            self.webhook.serve_forever()
+        finally:
+            self.webhook.shutdown()
+
+    def shutdown(self):
+        if getattr(self, "metrics_server", None) is not None:
+            self.metrics_server.shutdown()
+        self.config.close()
+        self.stats.close()
+        self.moderation.close()
+        self.support_inbox.close()
+        self.broadcaster.close()
+        self.storage.close()
+        self.users.close()
+        self.forwarded.close()